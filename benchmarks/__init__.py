@@ -0,0 +1,5 @@
+"""Reproducible benchmarks of curehack.
+
+Run ``python -m benchmarks.run --output results.json`` from the project
+root and compare two runs with ``python -m benchmarks.compare``.
+"""
@@ -0,0 +1,35 @@
+"""Compare two result files of :mod:`benchmarks.run`.
+
+    python -m benchmarks.compare before.json after.json
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+
+
+def main(argv=sys.argv):
+    if len(argv) != 3:
+        print('usage: python -m benchmarks.compare BEFORE.json AFTER.json')
+        return 2
+    with open(argv[1]) as f:
+        before = json.load(f)['results']
+    with open(argv[2]) as f:
+        after = json.load(f)['results']
+
+    print('%-50s %12s %12s %8s' % ('benchmark', 'before', 'after', 'ratio'))
+    for name in sorted(set(before) | set(after)):
+        old = before.get(name, {}).get('median')
+        new = after.get(name, {}).get('median')
+        ratio = '%.2fx' % (new / old) if old and new else '-'
+        print('%-50s %12s %12s %8s' % (name, _ms(old), _ms(new), ratio))
+    return 0
+
+
+def _ms(seconds):
+    return '-' if seconds is None else '%.3fms' % (seconds * 1000)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Synthetic corpora in the spirit of ``docclass.sample_train``."""
+
+import random
+
+
+SAMPLE_WORDS = ('nobody owns the water quick rabbit jumps fences buy '
+                'pharmaceuticals now make money online casino brown '
+                'fox').split()
+
+CATEGORIES = ('like', 'unlike', 'soso')
+
+
+class Corpus(object):
+    """Documents drawn from a Zipf-like vocabulary.
+
+    The same ``seed`` always produces the same documents.
+    """
+
+    def __init__(self, vocabulary=1000, categories=2, doc_length=50,
+                 seed=0):
+        self.random = random.Random(seed)
+        self.vocabulary = (list(SAMPLE_WORDS) +
+                           ['word%05d' % i for i in
+                            range(max(vocabulary - len(SAMPLE_WORDS), 0))])
+        self.categories = list(CATEGORIES[:categories]) + [
+            'cat%d' % i for i in range(categories - len(CATEGORIES))]
+        self.doc_length = doc_length
+
+    def word(self, category_index):
+        # Each category prefers a different rotation of the vocabulary.
+        rank = int(self.random.paretovariate(1.1)) - 1
+        offset = category_index * len(self.vocabulary) // 7
+        return self.vocabulary[(rank + offset) % len(self.vocabulary)]
+
+    def document(self, category_index):
+        return ' '.join(self.word(category_index)
+                        for _ in range(self.doc_length))
+
+    def labeled(self, count):
+        """``count`` (document, category) pairs"""
+        pairs = []
+        for _ in range(count):
+            i = self.random.randrange(len(self.categories))
+            pairs.append((self.document(i), self.categories[i]))
+        return pairs
+
+    def documents(self, count):
+        return [doc for doc, _ in self.labeled(count)]
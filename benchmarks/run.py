@@ -0,0 +1,257 @@
+"""Time training, classification and ranking of curehack.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --vocabulary 1000,20000 --doc-length 20,200 \\
+        --backends memory,sqlite,mongomock --wsgi --output results.json
+
+``mongomock`` and ``webtest`` are optional; a live mongod can be used with
+``--mongo-uri``. A backend that is unavailable is skipped, and the reason
+is printed and kept under ``skipped`` in the results. A benchmark that
+fails is kept under ``failed``, the others still run, and the exit status
+is 1. Every run is seeded, so two runs on the same machine time the same
+corpora.
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import traceback
+
+from curehack import backends
+from curehack import docclass
+from curehack import features
+from curehack import scoring
+from curehack.choice import LikingChoice
+
+from benchmarks.corpus import Corpus
+
+
+CLASSIFIERS = (
+    ('naivebayes', docclass.NaiveBayesClassifier),
+    ('complement', docclass.ComplementNaiveBayesClassifier),
+    ('fisher', docclass.FisherClassifier),
+)
+
+WEIGHTS = LikingChoice.int_mapping
+
+BACKENDS = ('memory', 'sqlite', 'mongomock', 'mongodb')
+
+MOCK_URI = 'mongodb://localhost:27017/curehack_benchmark'
+
+
+def measure(func, repeat=5, number=1):
+    """min and median seconds of one call of ``func``"""
+    times = sorted(t / number for t in
+                   timeit.repeat(func, repeat=repeat, number=number))
+    return {'min': times[0], 'median': times[len(times) // 2],
+            'repeat': repeat, 'number': number}
+
+
+class Skip(Exception):
+    """The benchmark cannot run here; the message says why"""
+
+
+def backend_factory(name, options, tmpdir):
+    if name == 'memory':
+        return backends.MemoryBackendFactory(weights=WEIGHTS)
+    elif name == 'sqlite':
+        return backends.SQLiteBackendFactory(
+            os.path.join(tmpdir, 'benchmark.sqlite'), WEIGHTS)
+    elif name in ('mongomock', 'mongodb'):
+        db = mongo_database(name, options)
+        return lambda user: docclass.MongoDBBackend(db, user, WEIGHTS)
+    raise ValueError('Unknown backend: %s' % name)
+
+
+def mongo_client(name, options):
+    if name == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            raise Skip('mongomock is not installed')
+        return mongomock.MongoClient(MOCK_URI)
+    if not options.mongo_uri:
+        raise Skip('--mongo-uri is not given')
+    import pymongo
+    return pymongo.MongoClient(options.mongo_uri)
+
+
+def mongo_database(name, options):
+    client = mongo_client(name, options)
+    client.drop_database('curehack_benchmark')
+    return client.curehack_benchmark
+
+
+def bench_docclass(factory, corpus, options, prefix):
+    results = {}
+    training = corpus.labeled(options.train_docs)
+    queries = corpus.documents(options.classify_docs)
+    users = ('user%d' % i for i in itertools.count())
+
+    def train():
+        classifier = docclass.DefaultClassifier(factory(next(users)))
+        for doc, cat in training:
+            classifier.train(doc, cat)
+
+    results[prefix + 'train'] = measure(train, repeat=options.repeat)
+
+    # The model every classification and ranking below reads from.
+    backend = factory('model')
+    docclass.DefaultClassifier(backend).train_many(training)
+    snapshot = backend.snapshot()
+    results[prefix + 'snapshot'] = measure(backend.snapshot,
+                                           repeat=options.repeat)
+
+    for name, cls in CLASSIFIERS:
+        variants = [('backend', backend, None),
+                    ('snapshot', docclass.SnapshotBackend(snapshot), None)]
+        if scoring.numpy is not None:
+            variants.append(('numpy', docclass.SnapshotBackend(snapshot),
+                             scoring.engine_for(snapshot)))
+        for variant, variant_backend, engine in variants:
+            classifier = cls(features.default_extractor, variant_backend,
+                             engine=engine)
+            results['%sclassify/%s/%s' % (prefix, name, variant)] = measure(
+                lambda: [classifier.classify(q) for q in queries],
+                repeat=options.repeat)
+
+    results[prefix + 'ranking'] = measure(
+        lambda: backend.ranking(top=50, bottom=50), repeat=options.repeat)
+    return results
+
+
+def bench_wsgi(options, corpus, prefix):
+    try:
+        import webtest
+    except ImportError:
+        raise Skip('webtest is not installed')
+
+    import curehack
+    if options.mongo_uri:
+        settings = {'mongo_uri': options.mongo_uri}
+    else:
+        settings = {'mongo_uri': MOCK_URI,
+                    'mongo_client': mongo_client('mongomock', options)}
+
+    app = webtest.TestApp(curehack.main({}, model_backend='memory',
+                                        **settings))
+    names = ['precure%d' % i for i in range(options.precures)]
+    for name, doc in zip(names, corpus.documents(len(names))):
+        app.post('/register/', {'name': name, 'description': doc})
+
+    votes = itertools.cycle(['like', 'soso', 'unlike'])
+    users = ('user%d' % i for i in itertools.count())
+
+    def train(user=None):
+        params = [('user', user or next(users))]
+        params.extend((name, next(votes)) for name in names)
+        app.post('/train/', params)
+
+    train('wsgi')
+    item = corpus.documents(1)[0]
+    results = {
+        prefix + 'home': measure(lambda: app.get('/'),
+                                 repeat=options.repeat),
+        prefix + 'train': measure(train, repeat=options.repeat),
+        prefix + 'result': measure(lambda: app.get('/result/wsgi/'),
+                                   repeat=options.repeat),
+        prefix + 'classify': measure(
+            lambda: app.get('/classify/wsgi/', {'item': item}),
+            repeat=options.repeat),
+    }
+    return results
+
+
+def parse_args(argv):
+    ints = lambda value: [int(v) for v in value.split(',')]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--backends', default='memory,sqlite,mongomock')
+    parser.add_argument('--mongo-uri', help='benchmark a live mongod too')
+    parser.add_argument('--vocabulary', type=ints, default=[1000, 10000])
+    parser.add_argument('--categories', type=ints, default=[2])
+    parser.add_argument('--doc-length', type=ints, default=[20, 200])
+    parser.add_argument('--train-docs', type=int, default=50)
+    parser.add_argument('--classify-docs', type=int, default=20)
+    parser.add_argument('--precures', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--wsgi', action='store_true',
+                        help='also time requests through the WSGI app')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    options = parse_args(argv)
+    names = options.backends.split(',')
+    if options.mongo_uri and 'mongodb' not in names:
+        names.append('mongodb')
+    unknown = sorted(set(names) - set(BACKENDS))
+    if unknown:
+        print('Unknown backends: %s' % ', '.join(unknown), file=sys.stderr)
+        return 2
+
+    results = {}
+    skipped = {}
+    failed = {}
+
+    def run(label, bench):
+        try:
+            results.update(bench())
+        except Skip as e:
+            skipped[label] = str(e)
+            print('%s skipped: %s' % (label, e), file=sys.stderr)
+        except Exception as e:
+            failed[label] = '%s: %s' % (type(e).__name__, e)
+            print('%s failed:' % label, file=sys.stderr)
+            traceback.print_exc()
+        else:
+            print('%s done' % label, file=sys.stderr)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for vocabulary, categories, doc_length in itertools.product(
+                options.vocabulary, options.categories, options.doc_length):
+            shape = 'v%d-c%d-l%d' % (vocabulary, categories, doc_length)
+            corpus = lambda: Corpus(vocabulary, categories, doc_length,
+                                    options.seed)
+            for name in names:
+                run('%s/%s' % (name, shape), lambda: bench_docclass(
+                    backend_factory(name, options,
+                                    tempfile.mkdtemp(dir=tmpdir)),
+                    corpus(), options, '%s/%s/' % (name, shape)))
+            if options.wsgi:
+                run('wsgi/%s' % shape, lambda: bench_wsgi(
+                    options, corpus(), 'wsgi/%s/' % shape))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': scoring.numpy is not None,
+            'options': vars(options),
+            'skipped': skipped,
+            'failed': failed,
+        },
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
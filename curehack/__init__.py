@@ -1,8 +1,18 @@
-from urlparse import urlparse
-
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 
-import pymongo
+from curehack import indexes
+from curehack import modelfile
+from curehack.backends import backend_factory_from_settings
+from curehack.cache import ModelCache
+from curehack.catalog import PrecureCatalog
+from curehack.coalescing import buffered_backend_factory_from_settings
+from curehack.choice import LikingChoice
+from curehack.connection import MongoConnector
+from curehack.forms import FormCache
+from curehack.httpcache import response_cache_from_settings
+from curehack.training import training_queue_from_settings
+from curehack.votes import vote_log_from_settings
 
 
 def main(global_config, **settings):
@@ -10,21 +20,51 @@ def main(global_config, **settings):
     """
     config = Configurator(settings=settings)
     config.add_static_view('static', 'static', cache_max_age=3600)
+    config.include('curehack.instrumentation')
+    config.add_view_predicate('prefers', 'curehack.views.PrefersPredicate')
 
-    db_url = urlparse(settings['mongo_uri'])
-    config.registry.db = pymongo.Connection(
-        host=db_url.hostname,
-        port=db_url.port,
-    )
+    connector = MongoConnector.from_settings(settings)
+    config.registry.mongo = connector
 
     def add_db(request):
-        db = config.registry.db[db_url.path[1:]]
-        if db_url.username and db_url.password:
-            db.authenticate(db_url.username, db_url.password)
-        return db
+        return connector.database()
 
     config.add_request_method(add_db, 'db', reify=True)
 
+    if asbool(settings.get('mongo_ensure_indexes', True)):
+        indexes.ensure_indexes(connector.database(),
+                               indexes.indexes_from_settings(settings))
+    indexes.check_query_plans(connector.database(),
+                              settings.get('mongo_explain_check', 'off'),
+                              indexes.queries_from_settings(settings))
+
+    config.registry.catalog = PrecureCatalog(
+        check_interval=float(settings.get('catalog_check_interval', 5)),
+        change_stream=asbool(settings.get('catalog_change_stream', False))
+    )
+    config.registry.forms = FormCache()
+    config.registry.response_cache = response_cache_from_settings(settings)
+    config.registry.model_cache = ModelCache(
+        int(settings.get('model_cache_max_bytes', 64 * 1024 * 1024))
+    )
+    config.registry.backend_factory = buffered_backend_factory_from_settings(
+        settings,
+        backend_factory_from_settings(settings, connector,
+                                      LikingChoice.int_mapping),
+        config.registry.model_cache
+    )
+    config.registry.vote_log = vote_log_from_settings(settings, connector)
+    config.registry.training_queue = training_queue_from_settings(
+        settings, config.registry.backend_factory,
+        config.registry.model_cache, config.registry.vote_log
+    )
+    if settings.get('model_warm_file'):
+        modelfile.warm(
+            settings['model_warm_file'], config.registry.model_cache,
+            config.registry.backend_factory,
+            load=settings.get('model_backend') == 'memory'
+        )
+
     config.add_route('home', '/',
                      factory='curehack.resources.PrecureNamesResource')
     config.add_route('precures', '/precures/',
@@ -33,6 +73,8 @@ def main(global_config, **settings):
                      factory='curehack.resources.PrecureRegisterResource')
     config.add_route('train', '/train/',
                      factory='curehack.resources.PrecureTrainResource')
+    config.add_route('classify_batch', '/classify/',
+                     factory='curehack.resources.PrecureClassifyBatchResource')
     config.add_route('classify', '/classify/{user}/',
                      factory='curehack.resources.PrecureClassifyResource')
     config.add_route('result', '/result/{user}/',
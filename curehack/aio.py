@@ -0,0 +1,228 @@
+"""Asyncio MongoDB backend and a thin ASGI app for classify and ranking.
+
+Python 3 only, and not imported by the WSGI app. It needs an asyncio
+MongoDB driver: ``pymongo.AsyncMongoClient`` (pymongo >= 4.9) or Motor
+(``pip install curehack[asgi]``). Only ``model_backend = mongodb`` is
+supported. Serve it with any ASGI server, e.g. an ``asgi.py`` of::
+
+    from pyramid.paster import get_appsettings
+    from curehack.aio import make_app
+    app = make_app(get_appsettings('production.ini'))
+
+and ``uvicorn asgi:app``. It answers what the JSON variants of the WSGI
+views do:
+
+``GET /classify/{user}/?item=...&k=N&features=N``
+    the ranked categories of ``item`` with their top features
+``GET /result/{user}/?top=N&bottom=N``
+    the most liked and unliked features
+
+Each classification loads only the rows of the item's features, with one
+``$in`` query issued concurrently with the category counts, so a single
+process serves many classifications without a thread per request.
+"""
+
+import asyncio
+import json
+import re
+from urllib.parse import parse_qsl
+
+import colander
+
+from curehack import docclass
+from curehack import features
+from curehack import schemas
+from curehack import scoring
+from curehack.choice import LikingChoice
+from curehack.connection import CLIENT_OPTIONS
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pragma: no cover
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+
+class AsyncMongoDBBackend(object):
+    """Reads the collections of ``docclass.MongoDBBackend`` with an asyncio
+    driver"""
+
+    def __init__(self, db, user, weights=None):
+        self.db = db
+        self.user = user
+        self.weights = weights
+
+    async def snapshot(self, features=None):
+        """The user's ``ModelSnapshot``, limited to ``features`` if given"""
+        spec = {'user': self.user}
+        if features is not None:
+            spec['feature'] = {'$in': list(features)}
+        feature_rows, cat_rows = await asyncio.gather(
+            self.db.features.find(spec, {'_id': 0, 'feature': 1,
+                                         'category': 1,
+                                         'count': 1}).to_list(None),
+            self.db.categories.find({'user': self.user},
+                                    {'_id': 0, 'category': 1,
+                                     'count': 1}).to_list(None))
+
+        counts = {}
+        for d in feature_rows:
+            counts.setdefault(d['feature'], {})[d['category']] = \
+                float(d['count'])
+        cat_counts = dict((d['category'], d['count']) for d in cat_rows)
+        return docclass.ModelSnapshot(counts, cat_counts)
+
+    async def ranking(self, top=None, bottom=None):
+        """Like ``MongoDBBackend.ranking``, both ends queried concurrently"""
+        if top is None or bottom is None:
+            ranges = [(1, None)]
+        else:
+            ranges = [(order, limit)
+                      for order, limit in [(-1, top), (1, bottom)]
+                      if limit != 0]
+
+        async def fetch(order, limit):
+            cursor = self.db.likings.find(
+                {'user': self.user}, {'_id': 0, 'feature': 1, 'score': 1}
+            ).sort('score', order)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list(None)
+
+        ranking = {}
+        for rows in await asyncio.gather(*[fetch(order, limit)
+                                           for order, limit in ranges]):
+            ranking.update((d['feature'], d['score']) for d in rows)
+        return sorted(ranking.items(), key=lambda x: x[1])
+
+    async def model_version(self):
+        totals = await self.db.totals.find_one(
+            {'user': self.user}, {'version': 1, 'updated_at': 1})
+        if totals:
+            return totals.get('version', 0), totals.get('updated_at')
+        return 0, None
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body):
+        super(HTTPError, self).__init__(status, body)
+        self.status = status
+        self.body = body
+
+
+class ClassifyApp(object):
+    """ASGI app serving classification and ranking from ``db``"""
+
+    routes = [
+        ('classify', re.compile(r'^/classify/([^/]+)/$')),
+        ('result', re.compile(r'^/result/([^/]+)/$')),
+    ]
+
+    def __init__(self, db, weights=None, client=None,
+                 extractor=features.default_extractor, ranking_limit=50):
+        self.db = db
+        self.weights = weights
+        self.client = client
+        self.extractor = extractor
+        self.ranking_limit = ranking_limit
+
+    def backend(self, user):
+        return AsyncMongoDBBackend(self.db, user, self.weights)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        try:
+            status, body = 200, await self.dispatch(scope)
+        except HTTPError as e:
+            status, body = e.status, e.body
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(b'content-type',
+                                 b'application/json; charset=utf-8')]})
+        await send({'type': 'http.response.body',
+                    'body': json.dumps(body).encode('utf-8')})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    closed = self.client.close()
+                    # AsyncMongoClient.close is a coroutine, Motor's is not
+                    if asyncio.iscoroutine(closed):
+                        await closed
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, scope):
+        for name, pattern in self.routes:
+            match = pattern.match(scope['path'])
+            if match:
+                break
+        else:
+            raise HTTPError(404, {'errors': {'': 'Not Found'}})
+        if scope['method'] not in ('GET', 'HEAD'):
+            raise HTTPError(405, {'errors': {'': 'Method Not Allowed'}})
+
+        # ASGI servers already percent-decode scope['path']
+        user = match.group(1)
+        query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        return await getattr(self, name)(user, query)
+
+    def validate(self, schema, query):
+        try:
+            return schema.deserialize(query)
+        except colander.Invalid as e:
+            raise HTTPError(400, {'errors': e.asdict()})
+
+    async def classify(self, user, query):
+        params = self.validate(schemas.PrecureExplainSchema(), query)
+        item = params['item']
+        snapshot = await self.backend(user).snapshot(self.extractor(item))
+        classifier = docclass.DefaultClassifier(
+            docclass.SnapshotBackend(snapshot),
+            engine=scoring.engine_for(snapshot))
+        explanations = classifier.explain(item, params['k'],
+                                          params['features'])
+        return dict(user=user,
+                    item=item,
+                    ranking=[dict(category=e['category'],
+                                  score=e['score'],
+                                  features=[dict(feature=f, contribution=c)
+                                            for f, c in e['features']])
+                             for e in explanations])
+
+    async def result(self, user, query):
+        schema = schemas.RankingSchema()
+        schema['top'].missing = schema['bottom'].missing = self.ranking_limit
+        ranking_range = self.validate(schema, query)
+        ranking = await self.backend(user).ranking(ranking_range['top'],
+                                                   ranking_range['bottom'])
+        return dict(user=user, ranking=ranking)
+
+
+def make_app(settings):
+    """The :class:`ClassifyApp` of the app ``settings``"""
+    if AsyncMongoClient is None:
+        raise RuntimeError('curehack.aio needs pymongo >= 4.9 or motor')
+    if settings.get('model_backend', 'mongodb') != 'mongodb':
+        raise ValueError('curehack.aio only reads model_backend = mongodb')
+
+    options = {}
+    for name, (option, convert) in CLIENT_OPTIONS.items():
+        if settings.get(name):
+            options[option] = convert(settings[name])
+    client = AsyncMongoClient(settings['mongo_uri'], **options)
+    return ClassifyApp(client.get_default_database(),
+                       LikingChoice.int_mapping,
+                       client=client,
+                       ranking_limit=int(settings.get('ranking_limit', 50)))
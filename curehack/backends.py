@@ -0,0 +1,559 @@
+"""Backends for :mod:`curehack.docclass` besides ``MongoDBBackend``.
+
+Every backend implements the interface of ``docclass.MongoDBBackend``
+(``inc_counts``, the ``get_*`` readers, ``categories``, ``snapshot``,
+``load_snapshot``, ``ranking``, ``model_version`` and ``commit``).
+``model_backend`` in the settings selects one of them through
+:func:`backend_factory_from_settings`; the precure catalog stays in MongoDB
+whichever backend holds the models.
+"""
+
+import datetime
+import hashlib
+import heapq
+import sqlite3
+import threading
+import time
+
+from pymongo import UpdateOne
+
+from curehack import docclass
+
+
+def _ranking(scores, top=None, bottom=None):
+    """Sort ``(feature, score)`` pairs like ``MongoDBBackend.ranking``"""
+    if top is None or bottom is None:
+        return sorted(scores, key=lambda x: x[1])
+    scores = list(scores)
+    ranking = dict(heapq.nlargest(top, scores, key=lambda x: x[1]))
+    ranking.update(heapq.nsmallest(bottom, scores, key=lambda x: x[1]))
+    return sorted(ranking.items(), key=lambda x: x[1])
+
+
+class MemoryStore(object):
+    """Models of every user, held in process memory"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.features = {}
+        self.cat_counts = {}
+        self.feature_totals = {}
+        self.likings = {}
+        # user -> (model version, updated at)
+        self.versions = {}
+
+    def users(self):
+        with self.lock:
+            return list(self.cat_counts)
+
+
+class MemoryBackend(docclass.Backend):
+    """Dict based backend keeping its counts in a :class:`MemoryStore`"""
+
+    def __init__(self, store, user, weights=None):
+        self.store = store
+        self.user = user
+        self.weights = weights
+
+    def inc_counts(self, feature_counts, cat_counts):
+        store = self.store
+        with store.lock:
+            features = store.features.setdefault(self.user, {})
+            totals = store.feature_totals.setdefault(self.user, {})
+            for (feature, cat), count in feature_counts.items():
+                counts = features.setdefault(feature, {})
+                counts[cat] = counts.get(cat, 0.0) + count
+                totals[feature] = totals.get(feature, 0.0) + count
+
+            likings = store.likings.setdefault(self.user, {})
+            for feature, score in self.liking_deltas(feature_counts).items():
+                likings[feature] = likings.get(feature, 0.0) + score
+
+            categories = store.cat_counts.setdefault(self.user, {})
+            for cat, count in cat_counts.items():
+                categories[cat] = categories.get(cat, 0) + count
+            if feature_counts or cat_counts:
+                self._touch()
+
+    def _touch(self):
+        """Bump the model version; the store lock must be held"""
+        version = self.store.versions.get(self.user, (0, None))[0]
+        self.store.versions[self.user] = (version + 1,
+                                          datetime.datetime.utcnow())
+
+    def model_version(self):
+        return self.store.versions.get(self.user, (0, None))
+
+    def get_feature_count(self, f, cat):
+        features = self.store.features.get(self.user, {})
+        return features.get(f, {}).get(cat, 0.0)
+
+    def get_cat_count(self, cat):
+        return self.store.cat_counts.get(self.user, {}).get(cat, 0)
+
+    def get_feature_total(self, f):
+        return self.store.feature_totals.get(self.user, {}).get(f, 0.0)
+
+    def total_count(self):
+        with self.store.lock:
+            return sum(self.store.cat_counts.get(self.user, {}).values())
+
+    def categories(self):
+        with self.store.lock:
+            return list(self.store.cat_counts.get(self.user, {}))
+
+    def snapshot(self):
+        with self.store.lock:
+            features = dict(
+                (feature, dict(counts)) for feature, counts
+                in self.store.features.get(self.user, {}).items())
+            cat_counts = dict(self.store.cat_counts.get(self.user, {}))
+        return docclass.ModelSnapshot(features, cat_counts)
+
+    def ranking(self, top=None, bottom=None):
+        with self.store.lock:
+            scores = list(self.store.likings.get(self.user, {}).items())
+        return _ranking(scores, top, bottom)
+
+    def delete_features(self, features):
+        with self.store.lock:
+            for table in (self.store.features, self.store.feature_totals,
+                          self.store.likings):
+                user_table = table.get(self.user, {})
+                for feature in features:
+                    user_table.pop(feature, None)
+            self._touch()
+
+    def load_snapshot(self, snapshot):
+        feature_counts = dict(((feature, cat), count)
+                              for feature, counts in snapshot.features.items()
+                              for cat, count in counts.items())
+        likings = self.liking_deltas(feature_counts)
+        with self.store.lock:
+            self.store.features[self.user] = dict(
+                (feature, dict(counts))
+                for feature, counts in snapshot.features.items())
+            self.store.feature_totals[self.user] = dict(
+                snapshot.feature_totals)
+            self.store.likings[self.user] = likings
+            self.store.cat_counts[self.user] = dict(snapshot.cat_counts)
+            self._touch()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    user TEXT NOT NULL, feature TEXT NOT NULL, category TEXT NOT NULL,
+    count REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, feature, category));
+CREATE TABLE IF NOT EXISTS feature_totals (
+    user TEXT NOT NULL, feature TEXT NOT NULL,
+    count REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, feature));
+CREATE TABLE IF NOT EXISTS categories (
+    user TEXT NOT NULL, category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, category));
+CREATE TABLE IF NOT EXISTS likings (
+    user TEXT NOT NULL, feature TEXT NOT NULL,
+    score REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, feature));
+CREATE INDEX IF NOT EXISTS likings_user_score ON likings (user, score);
+CREATE TABLE IF NOT EXISTS versions (
+    user TEXT NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL);
+"""
+
+# (insert a zero row if missing, then increment it), per table
+SQLITE_INCREMENTS = {
+    'features': (
+        'INSERT OR IGNORE INTO features (user, feature, category) '
+        'VALUES (?, ?, ?)',
+        'UPDATE features SET count = count + ? '
+        'WHERE user = ? AND feature = ? AND category = ?'),
+    'feature_totals': (
+        'INSERT OR IGNORE INTO feature_totals (user, feature) VALUES (?, ?)',
+        'UPDATE feature_totals SET count = count + ? '
+        'WHERE user = ? AND feature = ?'),
+    'categories': (
+        'INSERT OR IGNORE INTO categories (user, category) VALUES (?, ?)',
+        'UPDATE categories SET count = count + ? '
+        'WHERE user = ? AND category = ?'),
+    'likings': (
+        'INSERT OR IGNORE INTO likings (user, feature) VALUES (?, ?)',
+        'UPDATE likings SET score = score + ? WHERE user = ? AND feature = ?'),
+}
+
+
+class SQLiteBackend(docclass.Backend):
+    """SQLite backend buffering its writes until :meth:`commit`
+
+    Reads only see committed counts. ``Classifier.train_many`` commits
+    right after writing, so one training is one transaction.
+    """
+
+    def __init__(self, connection, user, weights=None):
+        self.connection = connection
+        self.user = user
+        self.weights = weights
+        self.pending = {}
+        self.pending_deletes = set()
+
+    def inc_counts(self, feature_counts, cat_counts):
+        self._pend('features', ((k, c) for k, c in feature_counts.items()))
+
+        totals = {}
+        for (feature, cat), count in feature_counts.items():
+            totals[feature] = totals.get(feature, 0) + count
+        self._pend('feature_totals', (((f,), c) for f, c in totals.items()))
+        self._pend('likings',
+                   (((f,), s) for f, s
+                    in self.liking_deltas(feature_counts).items()))
+        self._pend('categories',
+                   (((cat,), c) for cat, c in cat_counts.items()))
+
+    def _pend(self, table, increments):
+        pending = self.pending.setdefault(table, {})
+        for key, count in increments:
+            pending[key] = pending.get(key, 0) + count
+
+    def commit(self):
+        if not self.pending and not self.pending_deletes:
+            return
+        with self.connection:
+            self._touch()
+            for table in ('features', 'feature_totals', 'likings'):
+                self.connection.executemany(
+                    'DELETE FROM %s WHERE user = ? AND feature = ?' % table,
+                    [(self.user, f) for f in self.pending_deletes])
+            for table, pending in self.pending.items():
+                insert, update = SQLITE_INCREMENTS[table]
+                self.connection.executemany(
+                    insert, [(self.user,) + key for key in pending])
+                self.connection.executemany(
+                    update, [(count, self.user) + key
+                             for key, count in pending.items()])
+        self.pending = {}
+        self.pending_deletes = set()
+
+    def _touch(self):
+        """Bump the model version, within the current transaction"""
+        self.connection.execute(
+            'INSERT OR IGNORE INTO versions (user) VALUES (?)', (self.user,))
+        self.connection.execute(
+            'UPDATE versions SET version = version + 1, updated_at = ? '
+            'WHERE user = ?', (time.time(), self.user))
+
+    def model_version(self):
+        row = self.connection.execute(
+            'SELECT version, updated_at FROM versions WHERE user = ?',
+            (self.user,)).fetchone()
+        if row is None:
+            return 0, None
+        return row[0], datetime.datetime.utcfromtimestamp(row[1])
+
+    def delete_features(self, features):
+        """Delete ``features`` at the next :meth:`commit`"""
+        self.pending_deletes.update(features)
+
+    def load_snapshot(self, snapshot):
+        """Replace the user's model with ``snapshot`` in one transaction,
+        dropping uncommitted writes"""
+        feature_counts = dict(((feature, cat), count)
+                              for feature, counts in snapshot.features.items()
+                              for cat, count in counts.items())
+        rows = {
+            'features': [(self.user, f, c, n)
+                         for (f, c), n in feature_counts.items()],
+            'feature_totals': [(self.user, f, n) for f, n
+                               in snapshot.feature_totals.items()],
+            'likings': [(self.user, f, s) for f, s
+                        in self.liking_deltas(feature_counts).items()],
+            'categories': [(self.user, c, n)
+                           for c, n in snapshot.cat_counts.items()],
+        }
+        with self.connection:
+            self._touch()
+            for table, values in rows.items():
+                self.connection.execute(
+                    'DELETE FROM %s WHERE user = ?' % table, (self.user,))
+                if values:
+                    self.connection.executemany(
+                        'INSERT INTO %s VALUES (%s)' % (
+                            table, ', '.join('?' * len(values[0]))),
+                        values)
+        self.pending = {}
+        self.pending_deletes = set()
+
+    def _value(self, sql, *params):
+        row = self.connection.execute(sql, (self.user,) + params).fetchone()
+        return row[0] if row and row[0] is not None else 0
+
+    def get_feature_count(self, f, cat):
+        return float(self._value(
+            'SELECT count FROM features '
+            'WHERE user = ? AND feature = ? AND category = ?', f, cat))
+
+    def get_cat_count(self, cat):
+        return self._value('SELECT count FROM categories '
+                           'WHERE user = ? AND category = ?', cat)
+
+    def get_feature_total(self, f):
+        return float(self._value('SELECT count FROM feature_totals '
+                                 'WHERE user = ? AND feature = ?', f))
+
+    def total_count(self):
+        return self._value('SELECT SUM(count) FROM categories WHERE user = ?')
+
+    def categories(self):
+        return [row[0] for row in self.connection.execute(
+            'SELECT category FROM categories WHERE user = ?', (self.user,))]
+
+    def snapshot(self):
+        features = {}
+        for feature, cat, count in self.connection.execute(
+                'SELECT feature, category, count FROM features '
+                'WHERE user = ?', (self.user,)):
+            features.setdefault(feature, {})[cat] = count
+        cat_counts = dict(self.connection.execute(
+            'SELECT category, count FROM categories WHERE user = ?',
+            (self.user,)))
+        return docclass.ModelSnapshot(features, cat_counts)
+
+    def ranking(self, top=None, bottom=None):
+        select = 'SELECT feature, score FROM likings WHERE user = ? '
+        if top is None or bottom is None:
+            return self.connection.execute(select + 'ORDER BY score',
+                                           (self.user,)).fetchall()
+        ranking = dict(self.connection.execute(
+            select + 'ORDER BY score DESC LIMIT ?', (self.user, top)))
+        ranking.update(self.connection.execute(
+            select + 'ORDER BY score LIMIT ?', (self.user, bottom)))
+        return sorted(ranking.items(), key=lambda x: x[1])
+
+
+def document_id(item):
+    """Key of the shared feature vector of ``item``"""
+    return hashlib.sha1(item.encode('utf-8')).hexdigest()
+
+
+def store_vectors(db, vectors, operator):
+    """Upsert ``{document key: features}`` into ``documents``
+
+    ``operator`` is ``$setOnInsert`` to keep stored features or ``$set`` to
+    replace them.
+    """
+    db.documents.bulk_write([
+        UpdateOne({'_id': key}, {operator: {'features': list(features)}},
+                  upsert=True)
+        for key, features in vectors.items()
+    ], ordered=False)
+
+
+class SharedDocumentBackend(docclass.MongoDBTotalsMixin,
+                            docclass.Backend):
+    """MongoDB backend storing the features of each document once
+
+    Every trained document (in practice, a precure description) is
+    tokenized once and its features stored in ``documents``. A user's model
+    is only the number of times each document was trained per category, in
+    ``user_documents``; feature counts are derived from it in
+    :meth:`snapshot` (cached by ``ModelCache``), which every reader uses.
+    Training writes are O(documents) instead of O(words).
+
+    Training keeps the stored features of a document, so a changed
+    tokenizer only applies once ``curehack_retrain`` re-tokenizes them
+    (:meth:`SharedDocumentBackendFactory.store_documents`). Models are
+    made of documents, not counts: ``inc_counts``, ``delete_features`` and
+    ``load_snapshot`` are not supported, use :meth:`load_documents`.
+    """
+
+    stores_documents = True
+
+    def __init__(self, db, user, weights=None):
+        self.db = db
+        self.user = user
+        self.weights = weights
+        self._reader = None
+
+    def _count_documents(self, documents):
+        """Store the vectors of new ``(item, features, cat, count)``s and
+        return their counts by ``(document key, category)``"""
+        vectors = {}
+        counts = {}
+        for item, features, cat, count in documents:
+            key = document_id(item)
+            vectors[key] = features
+            counts[(key, cat)] = counts.get((key, cat), 0) + count
+        if vectors:
+            store_vectors(self.db, vectors, '$setOnInsert')
+        return counts
+
+    def inc_documents(self, documents):
+        counts = self._count_documents((item, features, cat, 1)
+                                       for item, features, cat in documents)
+        if not counts:
+            return
+        self.db.user_documents.bulk_write([
+            UpdateOne({'user': self.user, 'document': key, 'category': cat},
+                      {'$inc': {'count': count}}, upsert=True)
+            for (key, cat), count in counts.items()
+        ], ordered=False)
+        self.touch()
+        self._reader = None
+
+    def load_documents(self, documents):
+        """Replace the model with ``(item, features, cat, count)``s"""
+        counts = self._count_documents(documents)
+        self.db.user_documents.delete_many({'user': self.user})
+        if counts:
+            self.db.user_documents.insert_many(
+                [{'user': self.user, 'document': key, 'category': cat,
+                  'count': count}
+                 for (key, cat), count in counts.items()])
+        self.touch()
+        self._reader = None
+
+    def inc_counts(self, feature_counts, cat_counts):
+        raise NotImplementedError(
+            'SharedDocumentBackend is trained with inc_documents')
+
+    def snapshot(self):
+        rows = list(self.db.user_documents.find({'user': self.user}))
+        vectors = dict(
+            (d['_id'], d['features']) for d in self.db.documents.find(
+                {'_id': {'$in': list(set(r['document'] for r in rows))}}))
+
+        features = {}
+        cat_counts = {}
+        for row in rows:
+            cat, count = row['category'], row['count']
+            cat_counts[cat] = cat_counts.get(cat, 0) + count
+            for feature in vectors.get(row['document'], ()):
+                counts = features.setdefault(feature, {})
+                counts[cat] = counts.get(cat, 0.0) + count
+        return docclass.ModelSnapshot(features, cat_counts)
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = docclass.SnapshotBackend(self.snapshot())
+        return self._reader
+
+    def get_feature_count(self, f, cat):
+        return self.reader.get_feature_count(f, cat)
+
+    def get_cat_count(self, cat):
+        return self.reader.get_cat_count(cat)
+
+    def get_feature_total(self, f):
+        return self.reader.get_feature_total(f)
+
+    def total_count(self):
+        return self.reader.total_count()
+
+    def categories(self):
+        return self.reader.categories()
+
+    def ranking(self, top=None, bottom=None, snapshot=None):
+        """Likings derived from ``snapshot``, by default a fresh one
+
+        Pass the snapshot cached in ``ModelCache`` to rank without
+        reloading the user's documents.
+        """
+        if snapshot is None:
+            snapshot = self.reader.snapshot
+        feature_counts = dict(((feature, cat), count)
+                              for feature, counts in snapshot.features.items()
+                              for cat, count in counts.items())
+        return _ranking(self.liking_deltas(feature_counts).items(),
+                        top, bottom)
+
+    def delete_features(self, features):
+        raise NotImplementedError(
+            'Features of shared documents cannot be pruned per user')
+
+    def load_snapshot(self, snapshot):
+        raise NotImplementedError(
+            'A model of shared documents cannot be rebuilt from its counts')
+
+
+class MongoDBBackendFactory(object):
+    def __init__(self, connector, weights=None):
+        self.connector = connector
+        self.weights = weights
+
+    def __call__(self, user):
+        return docclass.MongoDBBackend(self.connector.database(), user,
+                                       self.weights)
+
+    def users(self):
+        return self.connector.database().categories.distinct('user')
+
+
+class MemoryBackendFactory(object):
+    def __init__(self, store=None, weights=None):
+        self.store = store or MemoryStore()
+        self.weights = weights
+
+    def __call__(self, user):
+        return MemoryBackend(self.store, user, self.weights)
+
+    def users(self):
+        return self.store.users()
+
+
+class SQLiteBackendFactory(object):
+    """Opens one connection per thread to the database at ``path``"""
+
+    def __init__(self, path, weights=None):
+        self.path = path
+        self.weights = weights
+        self.local = threading.local()
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(self.path)
+        return connection
+
+    def __call__(self, user):
+        return SQLiteBackend(self.connection, user, self.weights)
+
+    def users(self):
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT user FROM categories')]
+
+
+class SharedDocumentBackendFactory(MongoDBBackendFactory):
+    def __call__(self, user):
+        return SharedDocumentBackend(self.connector.database(), user,
+                                     self.weights)
+
+    def users(self):
+        return self.connector.database().user_documents.distinct('user')
+
+    def store_documents(self, documents):
+        """Store the features of ``(item, features)``s, replacing those
+        stored before (e.g. with another tokenizer)"""
+        vectors = dict((document_id(item), features)
+                       for item, features in documents)
+        if vectors:
+            store_vectors(self.connector.database(), vectors, '$set')
+
+
+def backend_factory_from_settings(settings, connector, weights=None):
+    """Backend factory selected by ``model_backend`` (mongodb, shared,
+    memory or sqlite)"""
+    name = settings.get('model_backend', 'mongodb')
+    if name == 'mongodb':
+        return MongoDBBackendFactory(connector, weights)
+    elif name == 'shared':
+        return SharedDocumentBackendFactory(connector, weights)
+    elif name == 'memory':
+        return MemoryBackendFactory(weights=weights)
+    elif name == 'sqlite':
+        return SQLiteBackendFactory(settings['sqlite_path'], weights)
+    raise ValueError('Unknown model_backend: %s' % name)
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread safe LRU mapping bounded by the total size of its values.
+
+    ``sizeof`` returns the size of a value; by default every value counts
+    as 1 so ``max_size`` is simply the maximum number of entries.
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = (value, size)
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_size:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._discard(next(iter(self._data)))
+
+    def get_or_set(self, key, factory):
+        """The value of ``key``, set to ``factory()`` on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return
+        self.size -= size
+
+
+class ModelCache(LRUCache):
+    """Per user cache of trained model snapshots.
+
+    Snapshots are evicted by their estimated memory footprint. They are
+    invalidated when the user trains in this process, and reloaded when
+    their ``version`` falls behind the model's, e.g. after a write by
+    another process or a script.
+    """
+
+    def __init__(self, max_bytes):
+        super(ModelCache, self).__init__(max_bytes,
+                                         sizeof=lambda snapshot:
+                                         snapshot.nbytes)
+        self._generations = {}
+
+    def load(self, user, loader, version=None):
+        """Return the snapshot of ``user``, calling ``loader`` on a miss.
+
+        With ``version``, the current model version of the user, a cached
+        snapshot of another version is a miss too. A snapshot loaded while
+        the user was invalidated is returned but not stored, so a training
+        that races the load is never hidden.
+        """
+        snapshot = self.get(user)
+        if snapshot is not None and (version is None or
+                                     snapshot.version == version):
+            return snapshot
+
+        generation = self._generations.get(user, 0)
+        snapshot = loader()
+        if self._generations.get(user, 0) == generation:
+            self.set(user, snapshot)
+        return snapshot
+
+    def invalidate(self, user):
+        with self._lock:
+            self._generations[user] = self._generations.get(user, 0) + 1
+        super(ModelCache, self).invalidate(user)
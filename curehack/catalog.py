@@ -0,0 +1,105 @@
+"""Process level cache of the precure catalog.
+
+The catalog (name -> description, plus the description's features) only
+changes when a precure is registered, which bumps a version counter in
+``meta``. The cache checks that counter at most every
+``catalog_check_interval`` seconds and reloads the catalog when it moved,
+so most requests run no catalog query at all. With
+``catalog_change_stream = true`` a MongoDB change stream, when the server
+supports it, invalidates the cache as soon as ``precures`` changes.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from curehack import features
+
+
+log = logging.getLogger(__name__)
+
+VERSION_ID = 'precures'
+
+Precure = collections.namedtuple('Precure', 'name description features')
+
+
+class PrecureCatalog(object):
+    def __init__(self, check_interval=5.0, change_stream=False,
+                 extractor=features.default_extractor):
+        self.check_interval = check_interval
+        self.change_stream = change_stream
+        self.extractor = extractor
+        # (version, OrderedDict of name -> Precure), replaced as a whole
+        self.state = (None, collections.OrderedDict())
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self._watching_pid = None
+
+    def names(self, db):
+        return list(self.current(db)[1])
+
+    def get(self, db, name):
+        return self.current(db)[1].get(name)
+
+    def all(self, db):
+        return list(self.current(db)[1].values())
+
+    def current(self, db):
+        """``(version, precures)``, reloaded first if the version changed"""
+        if self.change_stream and self._watching_pid != os.getpid():
+            self._watch(db)
+
+        now = time.time()
+        if (self.state[0] is not None and
+                now - self.checked_at < self.check_interval):
+            return self.state
+
+        with self.lock:
+            doc = db.meta.find_one({'_id': VERSION_ID})
+            version = doc['version'] if doc else 0
+            if version != self.state[0]:
+                self.state = (version, self._load(db))
+            self.checked_at = now
+        return self.state
+
+    def _load(self, db):
+        precures = collections.OrderedDict()
+        for d in db.precures.find():
+            if d['name'] not in precures:
+                description = d.get('description', '')
+                precures[d['name']] = Precure(d['name'], description,
+                                              self.extractor(description))
+        return precures
+
+    def invalidate(self):
+        """Check the version on the next access"""
+        self.checked_at = 0
+
+    def register(self, db, name, description):
+        db.precures.insert_one({'name': name, 'description': description})
+        db.meta.update_one({'_id': VERSION_ID}, {'$inc': {'version': 1}},
+                           upsert=True)
+        self.invalidate()
+
+    def _watch(self, db):
+        self._watching_pid = os.getpid()
+        if not hasattr(db.precures, 'watch'):
+            log.warning('This pymongo has no change streams; the precure '
+                        'catalog is checked every %ss', self.check_interval)
+            return
+        thread = threading.Thread(target=self._run_watch, args=(db,),
+                                  name='curehack-catalog-watch')
+        thread.daemon = True
+        thread.start()
+
+    def _run_watch(self, db):
+        try:
+            with db.precures.watch() as stream:
+                for change in stream:
+                    self.invalidate()
+        except Exception:
+            log.warning('Precure change stream unavailable; the catalog is '
+                        'checked every %ss', self.check_interval,
+                        exc_info=True)
@@ -0,0 +1,178 @@
+"""Write coalescing of counter increments.
+
+With ``write_buffer = true``, backends returned by the registry's backend
+factory write their increments to a process wide :class:`CounterBuffer`
+instead of the database. The buffer merges the increments of every user
+and flushes them, one ``inc_counts`` per user, when it holds
+``write_buffer_max_keys`` keys, when its oldest increment is older than
+``write_buffer_max_staleness_ms``, and at exit. N increments of the same
+(user, feature, category) become a single ``$inc`` of N.
+
+Reads go straight to the backend, so they may lag by the staleness.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from pyramid.settings import asbool
+
+from curehack import docclass
+
+
+log = logging.getLogger(__name__)
+
+
+class CounterBuffer(object):
+    def __init__(self, backend_factory, max_keys=10000, max_staleness=1.0,
+                 on_flush=None):
+        self.backend_factory = backend_factory
+        self.max_keys = max_keys
+        self.max_staleness = max_staleness
+        self.on_flush = on_flush
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._reset()
+        self._pid = None
+        self._stopped = threading.Event()
+
+    def _reset(self):
+        self.feature_counts = {}
+        self.cat_counts = {}
+        self.size = 0
+        self.oldest = None
+
+    def start(self):
+        """Start the flushing thread of the current process"""
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run,
+                                  name='curehack-write-buffer')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.max_staleness / 2.0):
+            self.flush_due()
+
+    def add(self, user, feature_counts, cat_counts):
+        self.start()
+        with self.lock:
+            self._merge(user, feature_counts, cat_counts)
+            if self.oldest is None:
+                self.oldest = time.time()
+
+    def _merge(self, user, feature_counts, cat_counts):
+        for counts, pending in ((feature_counts, self.feature_counts),
+                                (cat_counts, self.cat_counts)):
+            user_pending = pending.setdefault(user, {})
+            for key, count in counts.items():
+                if key not in user_pending:
+                    self.size += 1
+                user_pending[key] = user_pending.get(key, 0) + count
+
+    def is_due(self):
+        return (self.size >= self.max_keys or
+                (self.oldest is not None and
+                 time.time() - self.oldest >= self.max_staleness))
+
+    def flush_due(self):
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        """Write every pending increment, one ``inc_counts`` per user"""
+        with self.flush_lock:
+            with self.lock:
+                feature_counts = self.feature_counts
+                cat_counts = self.cat_counts
+                self._reset()
+
+            for user in set(feature_counts) | set(cat_counts):
+                user_features = feature_counts.get(user, {})
+                user_cats = cat_counts.get(user, {})
+                try:
+                    backend = self.backend_factory(user)
+                    backend.inc_counts(user_features, user_cats)
+                    backend.commit()
+                except Exception:
+                    log.exception('Failed to flush counters of %s, '
+                                  'keeping them for the next flush', user)
+                    with self.lock:
+                        self._merge(user, user_features, user_cats)
+                        if self.oldest is None:
+                            self.oldest = time.time()
+                    continue
+                if self.on_flush is not None:
+                    self.on_flush(user)
+
+
+class BufferedBackend(docclass.Backend):
+    """Backend writing to a :class:`CounterBuffer`, reading from ``backend``
+
+    ``commit`` flushes the buffer only when it is due, so increments of
+    concurrent trainings are still merged, and commits what was written to
+    ``backend`` directly (e.g. ``delete_features``).
+    """
+
+    def __init__(self, buffer, backend):
+        self.buffer = buffer
+        self.backend = backend
+        self.user = backend.user
+
+    def inc_documents(self, documents):
+        if getattr(self.backend, 'stores_documents', False):
+            self.backend.inc_documents(documents)
+        else:
+            super(BufferedBackend, self).inc_documents(documents)
+
+    def inc_counts(self, feature_counts, cat_counts):
+        self.buffer.add(self.user, feature_counts, cat_counts)
+
+    def commit(self):
+        self.buffer.flush_due()
+        self.backend.commit()
+
+    def load_snapshot(self, snapshot):
+        # Pending increments predate the snapshot replacing them.
+        self.buffer.flush()
+        self.backend.load_snapshot(snapshot)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+class BufferedBackendFactory(object):
+    def __init__(self, buffer, backend_factory):
+        self.buffer = buffer
+        self.backend_factory = backend_factory
+
+    def __call__(self, user):
+        return BufferedBackend(self.buffer, self.backend_factory(user))
+
+    def users(self):
+        return self.backend_factory.users()
+
+
+def buffered_backend_factory_from_settings(settings, backend_factory,
+                                           model_cache):
+    """``backend_factory`` wrapped in a write buffer if ``write_buffer`` is
+    on"""
+    if not asbool(settings.get('write_buffer', False)):
+        return backend_factory
+    buffer = CounterBuffer(
+        backend_factory,
+        max_keys=int(settings.get('write_buffer_max_keys', 10000)),
+        max_staleness=float(settings.get('write_buffer_max_staleness_ms',
+                                         1000)) / 1000,
+        on_flush=model_cache.invalidate)
+    return BufferedBackendFactory(buffer, backend_factory)
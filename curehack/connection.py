@@ -0,0 +1,76 @@
+"""MongoDB connection management.
+
+One pooled ``MongoClient`` is created lazily per process, so pre-fork
+servers never share sockets opened by their parent. Credentials in
+``mongo_uri`` are handled by the client, which authenticates each pooled
+socket once instead of every request.
+
+A client made elsewhere (e.g. a ``mongomock.MongoClient`` in tests and
+benchmarks) can be passed as ``client``, or as ``mongo_client`` in the
+settings given to ``curehack.main``; it is then used in every process.
+"""
+
+import os
+import threading
+
+import pymongo
+from pyramid.settings import asbool
+
+
+def _write_concern(value):
+    return int(value) if value.isdigit() else value
+
+
+# setting name: (MongoClient option, converter)
+CLIENT_OPTIONS = {
+    'mongo_max_pool_size': ('maxPoolSize', int),
+    'mongo_socket_timeout_ms': ('socketTimeoutMS', int),
+    'mongo_connect_timeout_ms': ('connectTimeoutMS', int),
+    'mongo_wait_queue_timeout_ms': ('waitQueueTimeoutMS', int),
+    'mongo_read_preference': ('readPreference', str),
+    'mongo_w': ('w', _write_concern),
+    'mongo_journal': ('journal', asbool),
+}
+
+
+class MongoConnector(object):
+    def __init__(self, uri, client=None, **options):
+        self.uri = uri
+        self.options = options
+        self.given_client = client
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        options = {}
+        for name, (option, convert) in CLIENT_OPTIONS.items():
+            if settings.get(name):
+                options[option] = convert(settings[name])
+        return cls(settings['mongo_uri'], settings.get('mongo_client'),
+                   **options)
+
+    @property
+    def client(self):
+        """The client of the current process, created on first use"""
+        if self.given_client is not None:
+            return self.given_client
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = pymongo.MongoClient(self.uri,
+                                                       **self.options)
+                    self._pid = pid
+        return self._client
+
+    def database(self):
+        """The database named in ``mongo_uri``"""
+        return self.client.get_default_database()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
@@ -28,54 +28,160 @@ And thanks to @knzm for improving the sample code!
 https://bitbucket.org/knzm/collective/
 """
 
-import re
+import sys
+import copy
+import datetime
 import math
 
+from pymongo import UpdateOne
 
-DefaultClassifier = lambda backend: NaiveBayesClassifier(get_words,
-                                                         backend)
+from curehack import features
 
 
-def get_words(doc):
-    splitter = re.compile(r'\W*')
-    words = [s.lower() for s in splitter.split(doc)
-             if 2 < len(s) < 20]
-    return dict([(w, 1) for w in words])
+DefaultClassifier = lambda backend, engine=None: NaiveBayesClassifier(
+    features.default_extractor, backend, engine=engine)
 
+get_words = features.get_words
 
-class MongoDBBackend(object):
-    def __init__(self, db, user):
-        self.db = db
-        self.user = user
+
+class Backend(object):
+    """学習結果を保存するバックエンドの基底クラス
+
+    サブクラスは inc_counts と読み出しのメソッドを実装する.
+    """
+
+    weights = None
 
     def inc_feature(self, feature, cat):
         """特徴 feature がカテゴリ cat に出現した回数を 1 増やす"""
-        features = self.db.features.find({'user': self.user,
-                                          'feature': feature,
-                                          'category': cat})
-        if features.count():
-            self.db.features.update({'user': self.user,
-                                     'feature': feature,
-                                     'category': cat},
-                                    {'$inc': {'count': 1.0}})
-        else:
-            self.db.features.insert({'user': self.user,
-                                     'feature': feature,
-                                     'category': cat,
-                                     'count': 1.0})
+        self.inc_features([feature], cat)
+
+    def inc_features(self, features, cat):
+        """特徴のリスト features がカテゴリ cat に出現した回数をまとめて 1 ずつ増やす"""
+        self.inc_counts(dict(((f, cat), 1) for f in features), {})
 
     def inc_category(self, cat):
         """カテゴリ cat が出現した回数を 1 増やす"""
-        categories = self.db.categories.find({'user': self.user,
-                                              'category': cat})
-        if categories.count():
-            self.db.categories.update({'user': self.user,
-                                       'category': cat},
-                                      {'$inc': {'count': 1}})
+        self.inc_counts({}, {cat: 1})
+
+    def inc_documents(self, documents):
+        """(アイテム, 特徴のリスト, カテゴリ) の組をまとめて学習結果に加える
+
+        すべての増分を集計してから inc_counts で一度に書き込む.
+        """
+        feature_counts = {}
+        cat_counts = {}
+        for item, features, cat in documents:
+            for f in features:
+                feature_counts[(f, cat)] = feature_counts.get((f, cat), 0) + 1
+            cat_counts[cat] = cat_counts.get(cat, 0) + 1
+        self.inc_counts(feature_counts, cat_counts)
+
+    def liking_deltas(self, feature_counts):
+        """特徴ごとに, 増分にカテゴリの重み weights を掛けた合計を返す"""
+        likings = {}
+        for (feature, cat), count in feature_counts.items():
+            weight = (self.weights or {}).get(cat, 0)
+            if weight:
+                likings[feature] = likings.get(feature, 0) + count * weight
+        return likings
+
+    def commit(self):
+        """学習結果を保存する"""
+        pass
+
+
+class MongoDBTotalsMixin(object):
+    """ユーザーごとの学習結果の版を MongoDB の totals に記録する
+
+    db と user を持つ MongoDB のバックエンドで使う.
+    """
+
+    def touch(self, inc=None, values=None):
+        """学習結果の版 (totals の version) を 1 増やし更新時刻を記録する
+
+        totals のほかのフィールドも inc の分だけ増やし, values に設定する.
+        """
+        inc = dict(inc or {}, version=1)
+        values = dict(values or {}, updated_at=datetime.datetime.utcnow())
+        self.db.totals.update_one({'user': self.user},
+                                  {'$inc': inc, '$set': values},
+                                  upsert=True)
+
+    def model_version(self):
+        """(学習結果の版, 最後に更新した時刻 (UTC)) を返す"""
+        totals = self.db.totals.find_one({'user': self.user},
+                                         {'version': 1, 'updated_at': 1})
+        if totals:
+            return totals.get('version', 0), totals.get('updated_at')
         else:
-            self.db.categories.insert({'user': self.user,
-                                       'category': cat,
-                                       'count': 1})
+            return 0, None
+
+
+class MongoDBBackend(MongoDBTotalsMixin, Backend):
+    """MongoDB に学習結果を保存するバックエンド
+
+    features, categories に加えて, ユーザーごとの集計値を
+    feature_totals (特徴ごとの全カテゴリの合計) と totals (全カテゴリの
+    出現回数) に学習時に書き込んでおき, 読み出しを 1 回の検索で済ませる.
+    totals には書き込むたびに増える学習結果の版 (version) も持つ.
+
+    カテゴリの重み weights ({カテゴリ: 重み}) を渡すと, 特徴ごとに
+    回数に重みを掛けた合計も likings に書き込んでおく (ranking で使う).
+    """
+
+    def __init__(self, db, user, weights=None):
+        self.db = db
+        self.user = user
+        self.weights = weights
+
+    def inc_counts(self, feature_counts, cat_counts):
+        """(特徴, カテゴリ) ごと, カテゴリごとの増分をまとめて書き込む
+
+        コレクションごとに 1 回の順不同バルク書き込み ($inc の upsert) で
+        送るので, 同時に学習しても重複したドキュメントは作られない.
+        """
+        if feature_counts:
+            self.db.features.bulk_write([
+                UpdateOne({'user': self.user,
+                           'feature': feature,
+                           'category': cat},
+                          {'$inc': {'count': float(count)}}, upsert=True)
+                for (feature, cat), count in feature_counts.items()
+            ], ordered=False)
+
+            feature_totals = {}
+            for (feature, cat), count in feature_counts.items():
+                feature_totals[feature] = \
+                    feature_totals.get(feature, 0) + count
+            self.db.feature_totals.bulk_write([
+                UpdateOne({'user': self.user, 'feature': feature},
+                          {'$inc': {'count': float(count)}}, upsert=True)
+                for feature, count in feature_totals.items()
+            ], ordered=False)
+
+            if self.weights:
+                self._inc_likings(feature_counts)
+
+        if cat_counts:
+            self.db.categories.bulk_write([
+                UpdateOne({'user': self.user, 'category': cat},
+                          {'$inc': {'count': count}}, upsert=True)
+                for cat, count in cat_counts.items()
+            ], ordered=False)
+
+        if feature_counts or cat_counts:
+            self.touch(inc={'count': sum(cat_counts.values())})
+
+    def _inc_likings(self, feature_counts):
+        likings = self.liking_deltas(feature_counts)
+        if not likings:
+            return
+        self.db.likings.bulk_write([
+            UpdateOne({'user': self.user, 'feature': feature},
+                      {'$inc': {'score': float(score)}}, upsert=True)
+            for feature, score in likings.items()
+        ], ordered=False)
 
     def get_feature_count(self, f, cat):
         """特徴 feature がカテゴリ cat に出現した回数を返す"""
@@ -96,28 +202,213 @@ class MongoDBBackend(object):
         else:
             return 0
 
+    def get_feature_total(self, f):
+        """特徴 feature がすべてのカテゴリに出現した回数の合計を返す"""
+        feature = self.db.feature_totals.find_one({'user': self.user,
+                                                   'feature': f})
+        if feature:
+            return float(feature['count'])
+        else:
+            return 0.0
+
     def total_count(self):
         """すべてのカテゴリの出現回数を返す"""
-        r = self.db.categories.aggregate([
-            {'$group': {'_id': None,
-             'total': {'$sum': '$count'}}}
-        ])
-        return r['result'][0]['total']
+        totals = self.db.totals.find_one({'user': self.user})
+        if totals:
+            return totals['count']
+        else:
+            return 0
 
     def categories(self):
         """すべてのカテゴリのリストを返す"""
         return map(lambda x: x['category'],
                    self.db.categories.find({'user': self.user}))
 
-    def commit(self):
-        """学習結果を保存する"""
-        pass
+    def snapshot(self):
+        """学習結果をまとめて読み込み ModelSnapshot として返す"""
+        features = {}
+        for d in self.db.features.find({'user': self.user},
+                                       {'_id': 0, 'feature': 1,
+                                        'category': 1, 'count': 1}):
+            features.setdefault(d['feature'], {})[d['category']] = \
+                float(d['count'])
+        cat_counts = dict((d['category'], d['count'])
+                          for d in self.db.categories.find({'user': self.user}))
+        return ModelSnapshot(features, cat_counts)
+
+    def ranking(self, top=None, bottom=None):
+        """特徴ごとの重み付きの合計 (likings) を小さい順に返す
+
+        top, bottom を指定すると合計の大きい top 件と小さい bottom 件
+        だけを返す. None は件数を制限しないので, どちらかが None なら
+        すべての特徴を返す.
+        """
+        if top is None or bottom is None:
+            ranges = [(1, None)]
+        else:
+            ranges = [(-1, top), (1, bottom)]
+
+        ranking = {}
+        for order, limit in ranges:
+            if limit == 0:
+                continue
+            cursor = self.db.likings.find(
+                {'user': self.user}, {'_id': 0, 'feature': 1, 'score': 1}
+            ).sort('score', order)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            for d in cursor:
+                ranking[d['feature']] = d['score']
+
+        return sorted(ranking.items(), key=lambda x: x[1])
+
+    def delete_features(self, features):
+        """特徴のリスト features をすべてのカテゴリから取り除く"""
+        features = list(features)
+        for i in range(0, len(features), 1000):
+            spec = {'user': self.user,
+                    'feature': {'$in': features[i:i + 1000]}}
+            self.db.features.delete_many(spec)
+            self.db.feature_totals.delete_many(spec)
+            self.db.likings.delete_many(spec)
+        self.touch()
+
+    def load_snapshot(self, snapshot):
+        """ユーザーの学習結果を ModelSnapshot の内容で置き換える
+
+        コレクションごとに 1 回の削除と 1 回のまとめての insert で書き込む.
+        """
+        spec = {'user': self.user}
+        for collection in (self.db.features, self.db.feature_totals,
+                           self.db.likings, self.db.categories):
+            collection.delete_many(spec)
+
+        features = [{'user': self.user, 'feature': feature,
+                     'category': cat, 'count': float(count)}
+                    for feature, counts in snapshot.features.items()
+                    for cat, count in counts.items()]
+        if features:
+            self.db.features.insert_many(features)
+            self.db.feature_totals.insert_many(
+                [{'user': self.user, 'feature': feature,
+                  'count': float(count)}
+                 for feature, count in snapshot.feature_totals.items()])
+
+        likings = self.liking_deltas(
+            dict(((d['feature'], d['category']), d['count'])
+                 for d in features))
+        if likings:
+            self.db.likings.insert_many(
+                [{'user': self.user, 'feature': feature, 'score': float(score)}
+                 for feature, score in likings.items()])
+
+        if snapshot.cat_counts:
+            self.db.categories.insert_many(
+                [{'user': self.user, 'category': cat, 'count': count}
+                 for cat, count in snapshot.cat_counts.items()])
+        self.touch(values={'count': snapshot.total})
+
+    def rebuild_aggregates(self):
+        """feature_totals, totals, likings を features, categories から作り直す
+
+        集計値を持たない古いデータを移行するときに使う.
+        """
+        weight = 0
+        for cat, w in (self.weights or {}).items():
+            if w:
+                weight = {'$cond': [{'$eq': ['$category', cat]}, w, weight]}
+        result = list(self.db.features.aggregate([
+            {'$match': {'user': self.user}},
+            {'$group': {'_id': '$feature',
+                        'count': {'$sum': '$count'},
+                        'score': {'$sum': {'$multiply': ['$count', weight]}}}}
+        ]))
+        self.db.feature_totals.delete_many({'user': self.user})
+        if result:
+            self.db.feature_totals.insert_many([{'user': self.user,
+                                                 'feature': d['_id'],
+                                                 'count': float(d['count'])}
+                                                for d in result])
+
+        if self.weights:
+            self.db.likings.delete_many({'user': self.user})
+            if result:
+                self.db.likings.insert_many([{'user': self.user,
+                                              'feature': d['_id'],
+                                              'score': float(d['score'])}
+                                             for d in result])
+
+        total = sum(d['count']
+                    for d in self.db.categories.find({'user': self.user}))
+        self.touch(values={'count': total})
+
+
+class ModelSnapshot(object):
+    """あるユーザーの学習結果をメモリ上に保持したもの
+
+    features は {特徴: {カテゴリ: 回数}}, cat_counts は {カテゴリ: 回数}.
+    version は読み込む前のバックエンドの model_version (わかれば).
+    """
+
+    def __init__(self, features, cat_counts, version=None):
+        self.features = features
+        self.cat_counts = cat_counts
+        self.version = version
+        self.feature_totals = dict((feature, sum(counts.values()))
+                                   for feature, counts in features.items())
+        self.total = sum(cat_counts.values())
+        self.nbytes = self._estimate_size()
+
+    def _estimate_size(self):
+        """おおよそのメモリ使用量 (バイト) を見積もる"""
+        size = sys.getsizeof(self.features) + sys.getsizeof(self.cat_counts)
+        for feature, counts in self.features.items():
+            size += (sys.getsizeof(feature) + sys.getsizeof(counts) +
+                     (len(counts) + 1) * sys.getsizeof(0.0))
+        return size + sys.getsizeof(self.feature_totals)
+
+
+class SnapshotBackend(Backend):
+    """ModelSnapshot から読み出すだけのバックエンド
+
+    データベースへの問い合わせを一切行わない.
+    """
+
+    in_memory = True
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get_feature_count(self, f, cat):
+        """特徴 feature がカテゴリ cat に出現した回数を返す"""
+        return self.snapshot.features.get(f, {}).get(cat, 0.0)
+
+    def get_feature_total(self, f):
+        """特徴 feature がすべてのカテゴリに出現した回数の合計を返す"""
+        return self.snapshot.feature_totals.get(f, 0.0)
+
+    def get_cat_count(self, cat):
+        """カテゴリ cat が出現した回数を返す"""
+        return self.snapshot.cat_counts.get(cat, 0)
+
+    def total_count(self):
+        """すべてのカテゴリの出現回数を返す"""
+        return self.snapshot.total
+
+    def categories(self):
+        """すべてのカテゴリのリストを返す"""
+        return list(self.snapshot.cat_counts)
+
+    def inc_counts(self, feature_counts, cat_counts):
+        raise NotImplementedError('SnapshotBackend is read only')
 
 
 class Classifier(object):
-    def __init__(self, get_features, backend):
+    def __init__(self, get_features, backend, engine=None):
         self.get_features = get_features
         self.backend = backend
+        # curehack.scoring.VectorModel があれば確率の計算を任せる
+        self.engine = engine
 
     def inc_feature(self, f, cat):
         """特徴 feature がカテゴリ cat に出現した回数を 1 増やす"""
@@ -135,6 +426,10 @@ class Classifier(object):
         """カテゴリ cat が出現した回数を返す"""
         return self.backend.get_cat_count(cat)
 
+    def get_feature_total(self, f):
+        """特徴 feature がすべてのカテゴリに出現した回数の合計を返す"""
+        return self.backend.get_feature_total(f)
+
     def total_count(self):
         """すべてのカテゴリの出現回数を返す"""
         return self.backend.total_count()
@@ -145,10 +440,22 @@ class Classifier(object):
 
     def train(self, item, cat):
         """アイテム item がカテゴリ cat に出現したことを学習する"""
-        features = self.get_features(item)
-        for f in features:
-            self.inc_feature(f, cat)
-        self.inc_category(cat)
+        self.train_many([(item, cat)])
+
+    def train_many(self, pairs):
+        """(アイテム, カテゴリ) の組をまとめて学習する
+
+        すべての増分を集計してからバックエンドへ一度に書き込む.
+        """
+        self.train_documents([(item, self.get_features(item), cat)
+                              for item, cat in pairs])
+
+    def train_documents(self, documents):
+        """(アイテム, 特徴のリスト, カテゴリ) の組をまとめて学習する
+
+        特徴を抽出済みのアイテム (カタログの説明文など) に使う.
+        """
+        self.backend.inc_documents(documents)
         self.backend.commit()
 
     def feature_prob(self, feature, cat):
@@ -164,18 +471,90 @@ class Classifier(object):
         """特徴 feature の出現頻度が低い場合の確率を補正する"""
 
         # 特徴 feature がすべてのカテゴリに出現した回数の合計
-        totals = sum([self.get_feature_count(feature, c)
-                      for c in self.categories()])
+        totals = self.get_feature_total(feature)
 
         # 重み付き平均を取る
         return ((weight * ap) + (totals * basic_prob)) / (weight + totals)
 
+    def scores(self, item):
+        """すべてのカテゴリについて prob(item, cat) を求める"""
+        return dict((cat, self.prob(item, cat)) for cat in self.categories())
+
+    def feature_terms(self, features):
+        """カテゴリごとに, 特徴 features のそれぞれがスコアに加える項を返す
+
+        単純ベイズ法では log(補正した Pr(feature | cat)).
+        """
+        return dict((cat, [math.log(self.weighted_prob(
+                        f, self.feature_prob(f, cat))) for f in features])
+                    for cat in self.categories())
+
+    def log_scores(self, item):
+        """すべてのカテゴリについて log(Pr(cat)) + feature_terms の和を求める
+
+        確率の積を取らずに対数の和を取るので, 長いアイテムでも 0 に
+        アンダーフローしない. 出現回数が 0 のカテゴリは -inf になる.
+        """
+        total = self.total_count()
+        scores = {}
+        for cat, terms in self.feature_terms(
+                list(self.get_features(item))).items():
+            cat_count = self.get_cat_count(cat)
+            if cat_count > 0:
+                scores[cat] = (math.log(float(cat_count) / total) +
+                               sum(terms))
+            else:
+                scores[cat] = float('-inf')
+        return scores
+
+    def rank(self, item, k=None):
+        """スコアの高い順に (カテゴリ, スコア) を k 件 (省略時はすべて) 返す"""
+        ranked = sorted(self.scores(item).items(), key=lambda x: x[1],
+                        reverse=True)
+        return ranked if k is None else ranked[:k]
+
+    def explain(self, item, k=None, top_features=5):
+        """rank の結果に, カテゴリごとにスコアを押し上げた特徴を添えて返す
+
+        学習結果は frozen で一度だけ読み込む. 特徴の寄与は, そのカテゴリ
+        での項から全カテゴリでの項の平均を引いたもの.
+        """
+        classifier = self.frozen()
+        features = list(classifier.get_features(item))
+        terms = classifier.feature_terms(features)
+        means = [sum(column) / len(column)
+                 for column in zip(*terms.values())]
+
+        explanations = []
+        for cat, score in classifier.rank(item, k):
+            contributions = sorted(
+                zip(features, [t - m for t, m in zip(terms[cat], means)]),
+                key=lambda x: x[1], reverse=True)
+            explanations.append({'category': cat,
+                                 'score': score,
+                                 'features': contributions[:top_features]})
+        return explanations
+
+    def frozen(self):
+        """学習結果を一度だけ読み込み, メモリ上で分類する複製を返す"""
+        if getattr(self.backend, 'in_memory', False):
+            return self
+        clone = copy.copy(self)
+        clone.backend = SnapshotBackend(self.backend.snapshot())
+        return clone
+
+    def classify_many(self, items, default=None):
+        """複数のアイテムをまとめて分類する"""
+        classifier = self.frozen()
+        return [classifier.classify(item, default) for item in items]
+
 
 class NaiveBayesClassifier(Classifier):
     """単純ベイズ法による分類機"""
 
-    def __init__(self, get_features, backend):
-        super(NaiveBayesClassifier, self).__init__(get_features, backend)
+    def __init__(self, get_features, backend, engine=None):
+        super(NaiveBayesClassifier, self).__init__(get_features, backend,
+                                                   engine)
         self.thresholds = {}
 
     def get_threshold(self, cat):
@@ -208,21 +587,33 @@ class NaiveBayesClassifier(Classifier):
         doc_prob = self.doc_prob(item, cat)
         return doc_prob * cat_prob
 
+    def scores(self, item):
+        """すべてのカテゴリについて log(Pr(item | cat) * Pr(cat)) を求める
+
+        確率が 0 のカテゴリは -inf になる.
+        """
+        if self.engine is not None:
+            return self.engine.bayes_log_probs(self.get_features(item))
+        return self.log_scores(item)
+
     def classify(self, item, default=None):
         """アイテム item が属す確率が最も高いカテゴリを選択する"""
-        probs = {}
-        max = 0.0
+        log_probs = self.scores(item)
+        max = float('-inf')
         best = default
-        for cat in self.categories():
-            probs[cat] = self.prob(item, cat)
-            if probs[cat] > max:
-                max = probs[cat]
+        for cat, log_prob in log_probs.items():
+            if log_prob > max:
+                max = log_prob
                 best = cat
 
-        for cat in probs:
+        if max == float('-inf'):
+            return default
+
+        log_threshold = math.log(self.get_threshold(best))
+        for cat in log_probs:
             if cat == best:
                 continue
-            if probs[cat] * self.get_threshold(best) > probs[best]:
+            if log_probs[cat] + log_threshold > log_probs[best]:
                 return default
 
         return best
@@ -234,13 +625,10 @@ class ComplementNaiveBayesClassifier(Classifier):
     def complement_doc_prob(self, item, cat):
         """Pr(item | cat 以外のカテゴリ) を求める"""
         p = 1.0
+        cat_count = self.total_count() - self.get_cat_count(cat)
         for feature in self.get_features(item):
-            feature_count = 0
-            cat_count = 0
-            for c in self.categories():
-                if c != cat:
-                    feature_count += self.get_feature_count(feature, c)
-                    cat_count += self.get_cat_count(c)
+            feature_count = (self.get_feature_total(feature) -
+                             self.get_feature_count(feature, cat))
             if cat_count == 0:
                 basic_prob = 0.0
             else:
@@ -248,6 +636,24 @@ class ComplementNaiveBayesClassifier(Classifier):
             p *= self.weighted_prob(feature, basic_prob)
         return p
 
+    def feature_terms(self, features):
+        """-log(補正した Pr(feature | cat 以外のカテゴリ))"""
+        total = self.total_count()
+        terms = {}
+        for cat in self.categories():
+            cat_count = total - self.get_cat_count(cat)
+            cat_terms = terms[cat] = []
+            for feature in features:
+                feature_count = (self.get_feature_total(feature) -
+                                 self.get_feature_count(feature, cat))
+                if cat_count == 0:
+                    basic_prob = 0.0
+                else:
+                    basic_prob = float(feature_count) / cat_count
+                cat_terms.append(
+                    -math.log(self.weighted_prob(feature, basic_prob)))
+        return terms
+
     def prob(self, item, cat):
         return self.complement_bayes_prob(item, cat)
 
@@ -257,12 +663,18 @@ class ComplementNaiveBayesClassifier(Classifier):
         doc_prob = self.complement_doc_prob(item, cat)
         return math.log(cat_prob) - math.log(doc_prob)
 
+    def scores(self, item):
+        """すべてのカテゴリについて
+        log(Pr(cat)) - log(Pr(item | cat 以外のカテゴリ)) を求める"""
+        if self.engine is not None:
+            return self.engine.complement_probs(self.get_features(item))
+        return self.log_scores(item)
+
     def classify(self, item, default=None):
         """アイテム item が属さない確率が最も低いカテゴリを選択する"""
         best = default
         max = 0.0
-        for cat in self.categories():
-            prob = self.prob(item, cat)
+        for cat, prob in self.scores(item).items():
             if prob > max:
                 max = prob
                 best = cat
@@ -273,8 +685,8 @@ class ComplementNaiveBayesClassifier(Classifier):
 class FisherClassifier(Classifier):
     """フィッシャー法による分類機"""
 
-    def __init__(self, get_features, backend):
-        super(FisherClassifier, self).__init__(get_features, backend)
+    def __init__(self, get_features, backend, engine=None):
+        super(FisherClassifier, self).__init__(get_features, backend, engine)
         self.minimums = {}
 
     def get_minimum(self, cat):
@@ -303,29 +715,55 @@ class FisherClassifier(Classifier):
 
     def fisher_prob(self, item, cat):
         """アイテム item がカテゴリ cat に属するスコアをフィッシャー法により求める"""
-        p = 1
+        return self.fisher_probs(item, [cat])[cat]
+
+    def fisher_probs(self, item, cats=None):
+        """カテゴリ cats (省略時はすべて) のフィッシャー法のスコアを求める
+
+        確率の積の代わりに対数の和を取るので, 長いアイテムでもアンダー
+        フローしない.
+        """
         features = self.get_features(item)
-        for feature in features:
-            basic_prob = self.cprob(feature, cat)
-            p *= self.weighted_prob(feature, basic_prob)
+        dof = len(features) * 2
+        return dict((cat, self.invchi2(-2 * sum(terms), dof))
+                    for cat, terms
+                    in self.feature_terms(features, cats).items())
 
-        fscore = -2 * math.log(p)
-        return self.invchi2(fscore, len(features) * 2)
+    def feature_terms(self, features, cats=None):
+        """log(補正した cprob(feature, cat))
+
+        特徴ごとに各カテゴリでの出現頻度を一度だけ求める.
+        """
+        categories = list(self.categories())
+        if cats is None:
+            cats = categories
+        cat_counts = dict((c, self.get_cat_count(c))
+                          for c in set(categories) | set(cats))
+
+        terms = dict((cat, []) for cat in cats)
+        for feature in features:
+            freqs = dict((c, float(self.get_feature_count(feature, c)) / n
+                          if n else 0.0) for c, n in cat_counts.items())
+            freq_sum = sum(freqs[c] for c in categories)
+            for cat in cats:
+                basic_prob = freqs[cat] / freq_sum if freqs[cat] else 0.0
+                terms[cat].append(
+                    math.log(self.weighted_prob(feature, basic_prob)))
+        return terms
 
     def invchi2(self, chi, dof):
         """カイ２乗の逆数を返す"""
-        m = chi / 2.0
-        sum = term = math.exp(-m)
-        for i in xrange(1, dof // 2):
-            term *= m / i
-            sum += term
-        return min(sum, 1.0)
+        return invchi2(chi, dof)
+
+    def scores(self, item):
+        if self.engine is not None:
+            return self.engine.fisher_probs(self.get_features(item))
+        return self.fisher_probs(item)
 
     def classify(self, item, default=None):
         best = default
         max = 0.0
-        for cat in self.categories():
-            prob = self.prob(item, cat)
+        for cat, prob in self.scores(item).items():
             if prob > max and prob > self.get_minimum(cat):
                 best = cat
                 max = prob
@@ -333,6 +771,40 @@ class FisherClassifier(Classifier):
         return best
 
 
+_log_factorials = [0.0]
+
+
+def log_factorials(n):
+    """log(i!) (0 <= i < n) の表を返す
+
+    計算した値はプロセス内で使い回す.
+    """
+    global _log_factorials
+    table = _log_factorials
+    if len(table) < n:
+        table = list(table)
+        while len(table) < n:
+            table.append(table[-1] + math.log(len(table)))
+        _log_factorials = table
+    return table[:n]
+
+
+def invchi2(chi, dof):
+    """カイ２乗の逆数を返す
+
+    級数の各項を対数で求めるので, 自由度 dof が大きくてもオーバーフロー
+    しない.
+    """
+    m = chi / 2.0
+    if m <= 0:
+        return 1.0
+    log_m = math.log(m)
+    total = 0.0
+    for i, log_factorial in enumerate(log_factorials(max(dof // 2, 1))):
+        total += math.exp(i * log_m - m - log_factorial)
+    return min(total, 1.0)
+
+
 def sample_train(cl):
     cl.train("Nobody owns the water.", "good")
     cl.train("the quick rabbit jumps fences", "good")
@@ -0,0 +1,91 @@
+"""Feature extractors for :mod:`curehack.docclass`.
+
+An extractor takes a document and returns a dict whose keys are the
+features of the document (the values are always 1), as ``get_words`` in
+``docclass`` always did.
+
+Precure descriptions are mostly Japanese, which has no spaces between
+words, so runs of kana and kanji are split into character n-grams instead
+of words.
+"""
+
+import re
+
+from curehack.cache import LRUCache
+
+
+CJK_CHARS = (u'\u3040-\u30ff'  # hiragana, katakana
+             u'\u3400-\u4dbf'  # CJK unified ideographs extension A
+             u'\u4e00-\u9fff'  # CJK unified ideographs
+             u'\uf900-\ufaff'  # CJK compatibility ideographs
+             u'\uff66-\uff9f')  # halfwidth katakana
+
+WORD_RE = re.compile(u'[^\\W' + CJK_CHARS + u']+', re.UNICODE)
+CJK_RE = re.compile(u'[' + CJK_CHARS + u']+', re.UNICODE)
+
+
+def iter_words(doc, min_length=3, max_length=19):
+    """Yield the lower cased non CJK words of ``doc``"""
+    for match in WORD_RE.finditer(doc):
+        word = match.group()
+        if min_length <= len(word) <= max_length:
+            yield word.lower()
+
+
+def iter_ngrams(doc, ns=(2, 3)):
+    """Yield the character n-grams of every CJK run in ``doc``
+
+    Runs shorter than the smallest n are yielded as they are.
+    """
+    for match in CJK_RE.finditer(doc):
+        run = match.group()
+        if len(run) < min(ns):
+            yield run
+            continue
+        for n in ns:
+            for i in range(len(run) - n + 1):
+                yield run[i:i + n]
+
+
+def get_words(doc):
+    return dict.fromkeys(iter_words(doc), 1)
+
+
+def get_ngrams(doc):
+    return dict.fromkeys(iter_ngrams(doc), 1)
+
+
+def get_mixed(doc):
+    features = get_words(doc)
+    features.update(get_ngrams(doc))
+    return features
+
+
+class Memoized(object):
+    """Memoize an extractor per document.
+
+    Training the same precure description again does not tokenize it
+    again. The returned dicts are shared, so callers must not modify them.
+    """
+
+    def __init__(self, extract, max_entries=1024):
+        self.extract = extract
+        self.memo = LRUCache(max_entries)
+
+    def __call__(self, doc):
+        return self.memo.get_or_set(doc, lambda: self.extract(doc))
+
+
+EXTRACTORS = {
+    'words': get_words,
+    'ngrams': get_ngrams,
+    'mixed': get_mixed,
+}
+
+
+def get_extractor(name, max_entries=1024):
+    """Memoized extractor registered as ``name`` in ``EXTRACTORS``"""
+    return Memoized(EXTRACTORS[name], max_entries)
+
+
+default_extractor = get_extractor('mixed')
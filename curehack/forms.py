@@ -0,0 +1,20 @@
+"""Cache of form schemas and rendered form HTML.
+
+Keys include everything the result depends on: the precure catalog
+version for the train form, and the action URL of every form.
+"""
+
+from curehack.cache import LRUCache
+
+
+class FormCache(object):
+    def __init__(self, max_entries=256):
+        self.schemas = LRUCache(max_entries)
+        self.html = LRUCache(max_entries)
+
+    def schema(self, key, factory):
+        return self.schemas.get_or_set(key, factory)
+
+    def render(self, key, factory):
+        """Rendered HTML of a form, ``factory`` building the form"""
+        return self.html.get_or_set(key, lambda: factory().render())
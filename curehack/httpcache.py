@@ -0,0 +1,80 @@
+"""HTTP caching of the pages computed from a user's model.
+
+A user's model only changes when it is written to, which bumps its
+version (``model_version()`` of every backend). The version and the time
+of the write are sent as the ``ETag``, with that time as
+``Last-Modified``, and conditional GETs of an unchanged model are
+answered with 304 before anything is computed. Classifications are validated with the version of
+the snapshot they score. With ``response_cache_max_entries`` set, the
+values the views render are also cached per (view, user, version, query).
+
+``Last-Modified`` has whole seconds, so it is only sent once the second
+of the write is over: until then, another write in the same second would
+carry the same date and ``If-Modified-Since`` would miss it.
+
+The version alone is not enough for the ``ETag``: the memory backend
+restarts its versions from 0 with the process, and a new model could
+reuse the ``ETag`` of the old one. The time of the write tells them apart.
+"""
+
+import calendar
+import datetime
+
+from pyramid import httpexceptions as httpexc
+from webob.datetime_utils import UTC
+
+from curehack.cache import LRUCache
+
+
+CONDITIONAL_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+
+def check_model_version(request, version, variant):
+    """Set the validators of ``request.response`` from the model version
+
+    ``version`` is ``(version, updated_at)`` of the model of the user in
+    the URL and ``variant`` names the representation (``html``,
+    ``json``). Raises ``HTTPNotModified`` when the client already has it.
+    """
+    number, updated_at = version
+    response = request.response
+    written = 0
+    if updated_at is not None:
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=UTC)
+        # milliseconds, the precision MongoDB keeps
+        written = (calendar.timegm(updated_at.utctimetuple()) * 1000 +
+                   updated_at.microsecond // 1000)
+        last_modified = updated_at.replace(microsecond=0)
+        now = datetime.datetime.now(UTC).replace(microsecond=0)
+        if last_modified < now:
+            response.last_modified = last_modified
+    response.etag = '%d-%d-%s' % (number, written, variant)
+    response.cache_control = 'private, no-cache'
+    response.vary = ('Accept',)
+
+    if request.if_none_match:
+        not_modified = response.etag in request.if_none_match
+    else:
+        not_modified = (request.if_modified_since is not None and
+                        response.last_modified is not None and
+                        response.last_modified <= request.if_modified_since)
+    if not_modified:
+        raise httpexc.HTTPNotModified(headers=[
+            (name, response.headers[name]) for name in CONDITIONAL_HEADERS
+            if name in response.headers])
+
+
+def cached(request, key, factory):
+    """``factory()``, cached under ``key`` if the response cache is on"""
+    cache = request.registry.response_cache
+    if cache is None:
+        return factory()
+    return cache.get_or_set(key, factory)
+
+
+def response_cache_from_settings(settings):
+    max_entries = int(settings.get('response_cache_max_entries', 0))
+    if not max_entries:
+        return None
+    return LRUCache(max_entries)
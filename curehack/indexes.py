@@ -0,0 +1,208 @@
+"""Index declarations for the MongoDB collections used by curehack.
+
+``INDEXES`` follows the access patterns of ``docclass.MongoDBBackend``,
+``resources.ResultResource``, the precure catalog and the votes log.
+``HOT_QUERIES`` are the shapes of the queries on the request path;
+:func:`check_query_plans` explains them and reports any that would scan a
+whole collection.
+
+Only the collections the configured ``model_backend`` keeps in MongoDB are
+indexed and checked. ``mongo_indexes`` in the settings replaces
+``INDEXES``, one index per line::
+
+    mongo_indexes =
+        features user feature category unique
+        likings user score:-1
+
+Models trained before the counters were upserted can hold duplicate rows,
+which the unique indexes refuse; ``curehack_rebuild_aggregates`` merges
+them (:func:`merge_duplicates`) and builds the indexes.
+"""
+
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+
+log = logging.getLogger(__name__)
+
+INDEXES = [
+    # (collection, keys, options)
+    ('features', [('user', 1), ('feature', 1), ('category', 1)],
+     {'unique': True}),
+    ('feature_totals', [('user', 1), ('feature', 1)], {'unique': True}),
+    ('categories', [('user', 1), ('category', 1)], {'unique': True}),
+    ('totals', [('user', 1)], {'unique': True}),
+    ('likings', [('user', 1), ('feature', 1)], {'unique': True}),
+    ('likings', [('user', 1), ('score', 1)], {}),
+    ('user_documents', [('user', 1), ('document', 1), ('category', 1)],
+     {'unique': True}),
+    ('precures', [('name', 1)], {}),
+    ('votes', [('user', 1), ('precure', 1), ('vote', 1)], {'unique': True}),
+]
+
+HOT_QUERIES = [
+    # (collection, spec, sort)
+    ('features', {'user': '', 'feature': '', 'category': ''}, None),
+    ('features', {'user': ''}, None),
+    ('feature_totals', {'user': '', 'feature': ''}, None),
+    ('categories', {'user': '', 'category': ''}, None),
+    ('categories', {'user': ''}, None),
+    ('totals', {'user': ''}, None),
+    ('likings', {'user': '', 'feature': ''}, None),
+    ('likings', {'user': ''}, [('score', -1)]),
+    ('user_documents', {'user': ''}, None),
+    ('meta', {'_id': ''}, None),
+]
+
+# Collections of the models, by model_backend; the others always are in
+# MongoDB.
+MODEL_COLLECTIONS = {
+    'mongodb': ('features', 'feature_totals', 'categories', 'totals',
+                'likings'),
+    'shared': ('documents', 'user_documents', 'totals'),
+}
+ALL_MODEL_COLLECTIONS = frozenset(name for names in MODEL_COLLECTIONS.values()
+                                  for name in names)
+
+EXPLAIN_MODES = ('off', 'warn', 'fail')
+
+
+class CollectionScan(Exception):
+    pass
+
+
+# Collections whose duplicate rows are merged by summing their count,
+# with the fields of their unique index.
+COUNTED_COLLECTIONS = [
+    ('features', ('user', 'feature', 'category')),
+    ('categories', ('user', 'category')),
+]
+
+
+def ensure_indexes(db, indexes=INDEXES):
+    """Build ``indexes``; returns those refused because of duplicates
+
+    A unique index over duplicate documents is logged and skipped, so the
+    app still starts with the data it had before.
+    """
+    failed = []
+    for collection, keys, options in indexes:
+        try:
+            db[collection].create_index(keys, **options)
+        except DuplicateKeyError:
+            log.error('Duplicate documents in %s refuse the unique index on '
+                      '%s; run curehack_rebuild_aggregates to merge them',
+                      collection, ', '.join(name for name, _ in keys))
+            failed.append((collection, keys, options))
+    return failed
+
+
+def merge_duplicates(db, collection, fields):
+    """Merge the documents of ``collection`` with the same ``fields``
+
+    The first document of each group keeps the sum of their ``count``
+    and the others are deleted. Returns the number of groups merged.
+    """
+    merged = 0
+    for group in db[collection].aggregate([
+        {'$group': {'_id': dict((field, '$' + field) for field in fields),
+                    'ids': {'$push': '$_id'},
+                    'count': {'$sum': '$count'},
+                    'documents': {'$sum': 1}}},
+        {'$match': {'documents': {'$gt': 1}}},
+    ], allowDiskUse=True):
+        first, others = group['ids'][0], group['ids'][1:]
+        db[collection].update_one({'_id': first},
+                                  {'$set': {'count': group['count']}})
+        db[collection].delete_many({'_id': {'$in': others}})
+        merged += 1
+    return merged
+
+
+def parse_indexes(text):
+    """``INDEXES`` style declarations of the ``mongo_indexes`` setting
+
+    Each line is a collection followed by its fields, ``field:-1`` for a
+    descending one, and optionally ``unique``.
+    """
+    indexes = []
+    for line in text.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        collection, fields = words[0], words[1:]
+        options = {}
+        if fields and fields[-1] == 'unique':
+            options['unique'] = True
+            fields = fields[:-1]
+        if not fields:
+            raise ValueError('No fields in mongo_indexes line: %r' % line)
+        keys = []
+        for field in fields:
+            name, _, direction = field.partition(':')
+            keys.append((name, int(direction or 1)))
+        indexes.append((collection, keys, options))
+    return indexes
+
+
+def in_mongodb(collection, backend):
+    """Whether ``collection`` is kept in MongoDB with ``model_backend``"""
+    return (collection not in ALL_MODEL_COLLECTIONS or
+            collection in MODEL_COLLECTIONS.get(backend, ()))
+
+
+def indexes_from_settings(settings):
+    """The indexes to ensure for the configured ``model_backend``"""
+    backend = settings.get('model_backend', 'mongodb')
+    if settings.get('mongo_indexes'):
+        indexes = parse_indexes(settings['mongo_indexes'])
+    else:
+        indexes = INDEXES
+    return [index for index in indexes if in_mongodb(index[0], backend)]
+
+
+def queries_from_settings(settings):
+    """The hot queries to explain for the configured ``model_backend``"""
+    backend = settings.get('model_backend', 'mongodb')
+    return [query for query in HOT_QUERIES if in_mongodb(query[0], backend)]
+
+
+def is_collection_scan(plan):
+    """Whether an ``explain()`` output contains a collection scan
+
+    Understands both the legacy (``BasicCursor``) and the query planner
+    (``COLLSCAN`` stage) formats.
+    """
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        if plan.get('cursor') == 'BasicCursor':
+            return True
+        return any(is_collection_scan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(is_collection_scan(v) for v in plan)
+    return False
+
+
+def check_query_plans(db, mode='warn', queries=HOT_QUERIES):
+    """Explain ``queries`` and warn about (or fail on) collection scans"""
+    if mode not in EXPLAIN_MODES:
+        raise ValueError('mode must be one of %s' % ', '.join(EXPLAIN_MODES))
+    if mode == 'off':
+        return []
+
+    scans = []
+    for collection, spec, sort in queries:
+        cursor = db[collection].find(spec)
+        if sort:
+            cursor = cursor.sort(sort)
+        if is_collection_scan(cursor.explain()):
+            scans.append((collection, sorted(spec)))
+
+    for collection, fields in scans:
+        log.warning('Collection scan on %s for query on %s',
+                    collection, ', '.join(fields))
+    if scans and mode == 'fail':
+        raise CollectionScan(scans)
+    return scans
@@ -0,0 +1,138 @@
+"""Per request instrumentation of backend calls.
+
+Enable it with ``instrumentation = true`` in the ini file. Every backend
+call made through :func:`instrument` is then counted and timed by name,
+and a tween logs the totals of each request and sends them in a
+``Server-Timing`` header. A sample of requests
+(``instrumentation_profile_sample_rate``) can be run under cProfile; those
+slower than ``instrumentation_profile_threshold_ms`` are logged, or dumped
+to ``instrumentation_profile_dir`` when it is set.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import random
+import time
+import timeit
+
+try:
+    from StringIO import StringIO
+except ImportError:  # pragma: no cover
+    from io import StringIO
+
+from pyramid.settings import asbool
+
+
+log = logging.getLogger(__name__)
+
+
+class RequestStats(object):
+    """Number of calls and seconds spent per backend operation"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def record(self, name, seconds):
+        count, total = self.calls.get(name, (0, 0.0))
+        self.calls[name] = (count + 1, total + seconds)
+
+    def summary(self):
+        return ', '.join('%s=%dx/%.1fms' % (name, count, seconds * 1000)
+                         for name, (count, seconds)
+                         in sorted(self.calls.items()))
+
+    def server_timing(self, elapsed):
+        metrics = ['total;dur=%.1f' % (elapsed * 1000)]
+        for name, (count, seconds) in sorted(self.calls.items()):
+            metrics.append('%s;dur=%.1f;desc="%d calls"'
+                           % (name, seconds * 1000, count))
+        return ', '.join(metrics)
+
+
+class InstrumentedBackend(object):
+    """Proxy recording every method call on ``backend`` in ``stats``"""
+
+    def __init__(self, backend, stats):
+        self.backend = backend
+        self.stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = timeit.default_timer()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.stats.record(name, timeit.default_timer() - start)
+        return timed
+
+
+def instrument(request, backend):
+    """``backend``, instrumented when instrumentation is enabled"""
+    if not getattr(request.registry, 'instrumentation', False):
+        return backend
+    return InstrumentedBackend(backend, request.backend_stats)
+
+
+def instrumentation_tween_factory(handler, registry):
+    settings = registry.settings
+    sample_rate = float(settings.get('instrumentation_profile_sample_rate',
+                                     0))
+    threshold = float(settings.get('instrumentation_profile_threshold_ms',
+                                   500)) / 1000
+    profile_dir = settings.get('instrumentation_profile_dir')
+
+    def instrumentation_tween(request):
+        profiler = None
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        start = timeit.default_timer()
+        try:
+            response = handler(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        elapsed = timeit.default_timer() - start
+
+        stats = request.backend_stats
+        response.headers['Server-Timing'] = stats.server_timing(elapsed)
+        log.info('%s %s %.1fms backend: %s', request.method, request.path,
+                 elapsed * 1000, stats.summary())
+
+        if profiler is not None and elapsed >= threshold:
+            _report_profile(profiler, request, elapsed, profile_dir)
+        return response
+
+    return instrumentation_tween
+
+
+def _report_profile(profiler, request, elapsed, profile_dir):
+    if profile_dir:
+        path = os.path.join(profile_dir, '%d-%s.prof' % (
+            time.time() * 1000, request.path.strip('/').replace('/', '_')))
+        profiler.dump_stats(path)
+        log.warning('Slow request %s %s (%.1fms), profile saved to %s',
+                    request.method, request.path, elapsed * 1000, path)
+    else:
+        out = StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(
+            'cumulative').print_stats(20)
+        log.warning('Slow request %s %s (%.1fms)\n%s', request.method,
+                    request.path, elapsed * 1000, out.getvalue())
+
+
+def includeme(config):
+    settings = config.registry.settings
+    if not asbool(settings.get('instrumentation', False)):
+        return
+    config.registry.instrumentation = True
+    config.add_request_method(lambda request: RequestStats(),
+                              'backend_stats', reify=True)
+    config.add_tween('curehack.instrumentation.instrumentation_tween_factory')
@@ -0,0 +1,185 @@
+"""Compact binary files of trained models.
+
+A model file holds the snapshots of any number of users::
+
+    b'CUREMDL1'                   magic
+    uint64 header offset
+    sections                      per user, 8 byte aligned:
+        vocabulary                features, UTF-8, joined by '\\n'
+        counts                    float64, features x categories, row major
+    header                        JSON: per user, its categories,
+                                  category counts and model version, and
+                                  the offsets and lengths of its sections
+
+Numbers are little endian. Every section is a plain array, so a file can
+be memory mapped with :func:`open_mapped` and only the users asked for
+are decoded.
+"""
+
+import array
+import json
+import mmap
+import struct
+import sys
+
+from curehack import docclass
+
+
+MAGIC = b'CUREMDL1'
+HEADER = struct.Struct('<8sQ')
+
+
+def _tobytes(values):
+    values = array.array('d', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes() if hasattr(values, 'tobytes') else \
+        values.tostring()
+
+
+def _frombytes(data):
+    values = array.array('d')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(bytes(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def dump(snapshots, fileobj):
+    """Write ``(user, ModelSnapshot)`` pairs to the binary ``fileobj``"""
+    fileobj.write(HEADER.pack(MAGIC, 0))
+    offset = HEADER.size
+    users = []
+
+    for user, snapshot in snapshots:
+        categories = list(snapshot.cat_counts)
+        vocabulary = list(snapshot.features)
+        entry = {
+            'user': user,
+            'categories': categories,
+            'cat_counts': [snapshot.cat_counts[c] for c in categories],
+            'version': snapshot.version,
+        }
+
+        sections = [
+            ('vocabulary', u'\n'.join(vocabulary).encode('utf-8')),
+            ('counts', _tobytes(snapshot.features[f].get(c, 0.0)
+                                for f in vocabulary for c in categories)),
+        ]
+        for name, data in sections:
+            padding = -offset % 8
+            fileobj.write(b'\0' * padding)
+            offset += padding
+            entry[name] = [offset, len(data)]
+            fileobj.write(data)
+            offset += len(data)
+        users.append(entry)
+
+    fileobj.write(json.dumps({'users': users}).encode('utf-8'))
+    fileobj.seek(0)
+    fileobj.write(HEADER.pack(MAGIC, offset))
+
+
+class ModelFile(object):
+    """Read access to a model file held in ``buffer`` (bytes or mmap)"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic, header_offset = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a curehack model file')
+        header = json.loads(buffer[header_offset:].decode('utf-8'))
+        self.entries = dict((entry['user'], entry)
+                            for entry in header['users'])
+
+    def users(self):
+        return list(self.entries)
+
+    def _section(self, entry, name):
+        offset, length = entry[name]
+        return self.buffer[offset:offset + length]
+
+    def snapshot(self, user):
+        entry = self.entries[user]
+        categories = entry['categories']
+        data = self._section(entry, 'vocabulary').decode('utf-8')
+        vocabulary = data.split(u'\n') if data else []
+        counts = _frombytes(self._section(entry, 'counts'))
+
+        width = len(categories)
+        features = {}
+        for i, feature in enumerate(vocabulary):
+            row = counts[i * width:(i + 1) * width]
+            features[feature] = dict((c, n) for c, n in zip(categories, row)
+                                     if n)
+        return docclass.ModelSnapshot(
+            features, dict(zip(categories, entry['cat_counts'])),
+            entry.get('version'))
+
+    def snapshots(self):
+        for user in self.entries:
+            yield user, self.snapshot(user)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return ModelFile(f.read())
+
+
+def open_mapped(path):
+    """Memory map the model file at ``path``"""
+    with open(path, 'rb') as f:
+        return ModelFile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _versioned_snapshot(backend):
+    # The version is read first, so the snapshot is never older than it.
+    version = backend.model_version()[0]
+    snapshot = backend.snapshot()
+    snapshot.version = version
+    return snapshot
+
+
+def export_models(backend_factory, path, users=None):
+    """Export the models of ``users`` (default: every user) to ``path``"""
+    users = list(users or backend_factory.users())
+    with open(path, 'wb') as f:
+        dump(((user, _versioned_snapshot(backend_factory(user)))
+              for user in users), f)
+    return users
+
+
+def import_models(backend_factory, path, users=None):
+    """Replace the models of ``users`` (default: all in the file)"""
+    model_file = load(path)
+    users = list(users or model_file.users())
+    for user in users:
+        backend_factory(user).load_snapshot(model_file.snapshot(user))
+    return users
+
+
+def warm(path, model_cache, backend_factory, load=False):
+    """Fill ``model_cache`` with the models in the file at ``path``
+
+    With ``load``, for backends that start empty in every process, models
+    are first loaded into ``backend_factory``. Otherwise only the models
+    still at the version they were exported at are cached; the others
+    were trained since and are left to load from the backend. Returns the
+    users whose models were cached.
+    """
+    model_file = open_mapped(path)
+    warmed = []
+    for user, snapshot in model_file.snapshots():
+        backend = backend_factory(user)
+        if load:
+            backend.load_snapshot(snapshot)
+            snapshot.version = backend.model_version()[0]
+        elif (snapshot.version is None or
+              snapshot.version != backend.model_version()[0]):
+            continue
+        model_cache.set(user, snapshot)
+        warmed.append(user)
+    return warmed
@@ -0,0 +1,67 @@
+"""Pruning of rarely useful features from trained models.
+
+Pruned features are deleted from the backend, so the classifiers treat
+them as unseen and fall back to the ``weighted_prob`` prior. Category
+counts are kept as they are.
+"""
+
+import heapq
+import math
+
+
+def frequency(snapshot, feature):
+    """Number of times ``feature`` was seen in any category"""
+    return snapshot.feature_totals.get(feature, 0.0)
+
+
+def _entropy(counts):
+    total = float(sum(counts))
+    if total <= 0:
+        return 0.0
+    return -sum(c / total * math.log(c / total) for c in counts if c > 0)
+
+
+def information_gain(snapshot, feature):
+    """Information gain of the category given whether ``feature`` appears"""
+    total = float(snapshot.total)
+    if total <= 0:
+        return 0.0
+    counts = snapshot.features.get(feature, {})
+    with_feature = [counts.get(cat, 0.0) for cat in snapshot.cat_counts]
+    without_feature = [max(snapshot.cat_counts[cat] - counts.get(cat, 0.0), 0)
+                       for cat in snapshot.cat_counts]
+    p = sum(with_feature) / total
+    return (_entropy(list(snapshot.cat_counts.values())) -
+            p * _entropy(with_feature) - (1 - p) * _entropy(without_feature))
+
+
+SCORES = {
+    'frequency': frequency,
+    'information_gain': information_gain,
+}
+
+
+def select_pruned(snapshot, min_count=0, max_features=None,
+                  score='frequency'):
+    """Features of ``snapshot`` to prune
+
+    Features seen fewer than ``min_count`` times are pruned, then only the
+    ``max_features`` best of the rest by ``score`` are kept.
+    """
+    score = SCORES[score]
+    kept = [f for f in snapshot.features
+            if frequency(snapshot, f) >= min_count]
+    if max_features is not None and len(kept) > max_features:
+        kept = heapq.nlargest(max_features, kept,
+                              key=lambda f: score(snapshot, f))
+    return set(snapshot.features) - set(kept)
+
+
+def prune(backend, min_count=0, max_features=None, score='frequency'):
+    """Prune the model of ``backend``, returning the pruned features"""
+    pruned = select_pruned(backend.snapshot(), min_count, max_features,
+                           score)
+    if pruned:
+        backend.delete_features(pruned)
+        backend.commit()
+    return pruned
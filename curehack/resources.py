@@ -1,20 +1,43 @@
 import deform
+from pyramid.decorator import reify
 
-from curehack import choice
 from curehack import docclass
+from curehack import instrumentation
 from curehack import schemas
+from curehack import scoring
 
 
 class BaseResource(object):
     def __init__(self, request):
         self.request = request
 
+    def backend(self, user):
+        return instrumentation.instrument(
+            self.request, self.request.registry.backend_factory(user))
+
+
+class ModelVersionMixin(object):
+    @reify
+    def model_version(self):
+        """``(version, updated_at)`` of the user's model"""
+        return self.backend(self.user).model_version()
+
 
 class PrecureNamesMixin(object):
     @property
     def precure_names(self):
-        return [d['name']
-                for d in self.request.db.precures.find({}, {'name': 1})]
+        return self.request.registry.catalog.names(self.request.db)
+
+    @reify
+    def train_schema(self):
+        """``(catalog version, schema)``, the schema shared while the
+        catalog does not change"""
+        version, precures = self.request.registry.catalog.current(
+            self.request.db)
+        schema = self.request.registry.forms.schema(
+            ('train', version),
+            lambda: schemas.PrecureTrainSchemaNode(list(precures)))
+        return version, schema
 
 
 class PrecureNamesResource(BaseResource, PrecureNamesMixin):
@@ -24,11 +47,12 @@ class PrecureNamesResource(BaseResource, PrecureNamesMixin):
 class PrecuresResource(BaseResource):
     @property
     def precures(self):
-        return self.request.db.precures.find()
+        return [dict(name=p.name, description=p.description)
+                for p in self.request.registry.catalog.all(self.request.db)]
 
 
 class PrecureRegisterResource(BaseResource):
-    @property
+    @reify
     def appstruct(self):
         controls = self.request.POST.items()
         schema = schemas.PrecureRegisterSchema()
@@ -46,10 +70,10 @@ class PrecureRegisterResource(BaseResource):
 
 
 class PrecureTrainResource(BaseResource, PrecureNamesMixin):
-    @property
+    @reify
     def appstruct(self):
         controls = self.request.POST.items()
-        schema = schemas.PrecureTrainSchemaNode(self.precure_names)
+        version, schema = self.train_schema
         form = deform.Form(schema)
         appstruct = form.validate(controls)
         return appstruct
@@ -60,32 +84,63 @@ class PrecureTrainResource(BaseResource, PrecureNamesMixin):
 
     @property
     def category_names(self):
-        appstruct = self.appstruct
+        appstruct = dict(self.appstruct)
         appstruct.pop('user')
         return [(vote, name)
                 for name, vote in appstruct.items() if vote != 'soso']
 
     @property
-    def category_descriptions(self):
-        """Pairs of categories and distription text of precures"""
-        category_descriptions = []
-        for category, name in self.category_names:
-            description = self.request.db.precures.find_one(
-                {'name': name}
-            ).get('description', '')
-
-            category_descriptions.append((category, description))
+    def documents(self):
+        """``(description, features, category)`` of the voted precures
 
-        return category_descriptions
+        The features are those the catalog extracted once per description.
+        """
+        catalog = self.request.registry.catalog
+        documents = []
+        for category, name in self.category_names:
+            precure = catalog.get(self.request.db, name)
+            documents.append((precure.description, precure.features,
+                              category))
+        return documents
 
     @property
     def classifier(self):
-        backend = docclass.MongoDBBackend(self.request.db, self.user)
-        return docclass.DefaultClassifier(backend)
+        return docclass.DefaultClassifier(self.backend(self.user))
 
 
-class PrecureClassifyResource(BaseResource):
-    @property
+class ClassifierMixin(object):
+    def snapshot_for(self, user, version=None):
+        """Cached model snapshot of ``user``, reloaded if it is stale
+
+        ``version`` is the user's ``model_version()`` if already read. It
+        is read before the counts, so a snapshot is never older than the
+        version it is tagged with.
+        """
+        backend = self.backend(user)
+        if version is None:
+            version = backend.model_version()
+
+        def load():
+            snapshot = backend.snapshot()
+            snapshot.version = version[0]
+            return snapshot
+
+        return self.request.registry.model_cache.load(user, load, version[0])
+
+    def classifier_for(self, user, version=None):
+        """Classifier of ``user`` reading from the cached model snapshot"""
+        return self.snapshot_classifier(self.snapshot_for(user, version))
+
+    def snapshot_classifier(self, snapshot):
+        backend = instrumentation.instrument(
+            self.request, docclass.SnapshotBackend(snapshot))
+        return docclass.DefaultClassifier(backend,
+                                          engine=scoring.engine_for(snapshot))
+
+
+class PrecureClassifyResource(BaseResource, ClassifierMixin,
+                              ModelVersionMixin):
+    @reify
     def appstruct(self):
         controls = self.request.GET.items()
         schema = schemas.PrecureClassifySchema()
@@ -97,33 +152,82 @@ class PrecureClassifyResource(BaseResource):
     def item(self):
         return self.appstruct['item']
 
+    @reify
+    def explain_params(self):
+        schema = schemas.PrecureExplainSchema()
+        return schema.deserialize(dict(self.request.GET.items()))
+
     @property
     def user(self):
         return self.request.matchdict['user']
 
+    @reify
+    def snapshot(self):
+        """The model snapshot this request scores with"""
+        return self.snapshot_for(self.user, self.model_version)
+
+    @property
+    def scored_version(self):
+        """``(version, updated_at)`` of :attr:`snapshot`"""
+        return self.snapshot.version, self.model_version[1]
+
     @property
     def classifier(self):
-        backend = docclass.MongoDBBackend(self.request.db, self.user)
-        return docclass.DefaultClassifier(backend)
+        return self.snapshot_classifier(self.snapshot)
+
+
+class PrecureClassifyBatchResource(BaseResource, ClassifierMixin):
+    @reify
+    def appstruct(self):
+        schema = schemas.PrecureClassifyBatchSchema()
+        return schema.deserialize(self.request.json_body)
 
+    @property
+    def user_items(self):
+        """(user, item) pairs in request order"""
+        appstruct = self.appstruct
+        return ([(appstruct['user'], item) for item in appstruct['items']] +
+                [tuple(pair) for pair in appstruct['pairs']])
 
-class ResultResource(BaseResource):
+
+class ResultResource(BaseResource, ClassifierMixin, ModelVersionMixin):
     @property
     def user(self):
         return self.request.matchdict['user']
 
+    @property
+    def updating(self):
+        """Whether training of the user is still queued
+
+        Waits up to ``training_wait_ms`` for the version the train view
+        redirected with, if this process queued it.
+        """
+        training_queue = self.request.registry.training_queue
+        if training_queue is None:
+            return False
+        version = training_queue.version_of(
+            self.request.GET.get('version', ''))
+        if version is not None:
+            timeout = float(self.request.registry.settings.get(
+                'training_wait_ms', 1000)) / 1000
+            return not training_queue.wait(self.user, version, timeout)
+        return training_queue.is_pending(self.user)
+
+    @property
+    def ranking_range(self):
+        limit = int(self.request.registry.settings.get('ranking_limit', 50))
+        schema = schemas.RankingSchema()
+        schema['top'].missing = schema['bottom'].missing = limit
+        return schema.deserialize(dict(self.request.GET.items()))
+
     @property
     def ranking(self):
-        ds = self.request.db.features.find(
-            {'user': self.user}
-        ).sort('count')
-
-        ret = {}
-        for d in ds:
-            liking = d['count'] * int(choice.LikingChoice(d['category']))
-            if d['feature'] in ret:
-                ret[d['feature']] += liking
-            else:
-                ret[d['feature']] = liking
-
-        return sorted(ret.items(), key=lambda x: x[1])
+        ranking_range = self.ranking_range
+        backend = self.backend(self.user)
+        if getattr(backend, 'stores_documents', False):
+            # derived from the counts, so rank the cached snapshot
+            return backend.ranking(
+                top=ranking_range['top'], bottom=ranking_range['bottom'],
+                snapshot=self.snapshot_for(self.user, self.model_version))
+        return backend.ranking(top=ranking_range['top'],
+                               bottom=ranking_range['bottom'])
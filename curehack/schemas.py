@@ -22,6 +22,52 @@ class PrecureClassifySchema(colander.MappingSchema):
     item = colander.SchemaNode(colander.String())
 
 
+class PrecureExplainSchema(PrecureClassifySchema):
+    """Query of a JSON classification: the ``k`` best categories (default
+    all) and the ``features`` contributing most to each"""
+    k = colander.SchemaNode(colander.Int(), missing=None,
+                            validator=colander.Range(min=1))
+    features = colander.SchemaNode(colander.Int(), missing=5,
+                                   validator=colander.Range(min=0, max=100))
+
+
+class RankingSchema(colander.MappingSchema):
+    """Number of the most liked (``top``) and unliked (``bottom``) features
+    to show on the result page"""
+    top = colander.SchemaNode(colander.Int(),
+                              validator=colander.Range(min=0, max=1000))
+    bottom = colander.SchemaNode(colander.Int(),
+                                 validator=colander.Range(min=0, max=1000))
+
+
+class ClassifyItemsSchema(colander.SequenceSchema):
+    item = colander.SchemaNode(colander.String())
+
+
+class ClassifyPairSchema(colander.TupleSchema):
+    user = colander.SchemaNode(colander.String())
+    item = colander.SchemaNode(colander.String())
+
+
+class ClassifyPairsSchema(colander.SequenceSchema):
+    pair = ClassifyPairSchema()
+
+
+class PrecureClassifyBatchSchema(colander.MappingSchema):
+    """JSON body of a batch classification.
+
+    Either ``user`` and a list of ``items``, or a list of ``[user, item]``
+    ``pairs`` (or both).
+    """
+    user = colander.SchemaNode(colander.String(), missing=None)
+    items = ClassifyItemsSchema(missing=())
+    pairs = ClassifyPairsSchema(missing=())
+
+    def validator(self, node, value):
+        if value['items'] and not value['user']:
+            raise colander.Invalid(node['user'], 'Required with items')
+
+
 class Choice(colander.String):
     def __init__(self, choice_class, encoding=None):
         self.choice_class = choice_class
@@ -0,0 +1,129 @@
+"""Vectorized scoring engine for the classifiers in :mod:`curehack.docclass`.
+
+A user's counts are loaded once into dense arrays (a feature vocabulary x
+category matrix and a category count vector) and every category is scored
+at once in log space, so long descriptions no longer underflow to 0.
+
+NumPy is optional; :func:`engine_for` returns ``None`` without it and the
+classifiers fall back to the pure Python implementation.
+"""
+
+from curehack import docclass
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def engine_for(snapshot):
+    """Return the (memoized) :class:`VectorModel` of ``snapshot``."""
+    if numpy is None:
+        return None
+    model = getattr(snapshot, 'vector_model', None)
+    if model is None:
+        model = snapshot.vector_model = VectorModel(snapshot)
+    return model
+
+
+class VectorModel(object):
+    """Dense array view of a :class:`curehack.docclass.ModelSnapshot`."""
+
+    def __init__(self, snapshot):
+        self.categories = list(snapshot.cat_counts)
+        columns = dict((cat, i) for i, cat in enumerate(self.categories))
+        self.vocabulary = dict((feature, i)
+                               for i, feature in enumerate(snapshot.features))
+
+        # The extra last row stays zero and stands for unseen features.
+        self.counts = numpy.zeros((len(self.vocabulary) + 1,
+                                   len(self.categories)))
+        for feature, counts in snapshot.features.items():
+            row = self.vocabulary[feature]
+            for cat, count in counts.items():
+                if cat in columns:
+                    self.counts[row, columns[cat]] = count
+
+        self.cat_counts = numpy.array([snapshot.cat_counts[cat]
+                                       for cat in self.categories],
+                                      dtype=float)
+        self.total = float(self.cat_counts.sum())
+        self.feature_totals = self.counts.sum(axis=1)
+
+    def rows(self, features):
+        unseen = len(self.vocabulary)
+        return numpy.array([self.vocabulary.get(f, unseen) for f in features],
+                           dtype=int)
+
+    def _as_dict(self, scores):
+        return dict(zip(self.categories, scores.tolist()))
+
+    def feature_probs(self, rows):
+        """Pr(feature | cat) for every (row, category) pair."""
+        return _divide(self.counts[rows], self.cat_counts)
+
+    def weighted_probs(self, rows, basic_probs, weight=1.0, ap=0.5):
+        totals = self.feature_totals[rows][:, numpy.newaxis]
+        return ((weight * ap) + (totals * basic_probs)) / (weight + totals)
+
+    def cat_log_probs(self):
+        with numpy.errstate(divide='ignore'):
+            return numpy.log(_divide(self.cat_counts, self.total))
+
+    def bayes_log_probs(self, features, weight=1.0, ap=0.5):
+        """log(Pr(item | cat) * Pr(cat)) of every category."""
+        rows = self.rows(features)
+        weighted = self.weighted_probs(rows, self.feature_probs(rows),
+                                       weight, ap)
+        doc_log_probs = numpy.log(weighted).sum(axis=0)
+        return self._as_dict(doc_log_probs + self.cat_log_probs())
+
+    def complement_probs(self, features, weight=1.0, ap=0.5):
+        """log(Pr(cat)) - log(Pr(item | categories other than cat))."""
+        rows = self.rows(features)
+        other_counts = (self.feature_totals[rows][:, numpy.newaxis] -
+                        self.counts[rows])
+        basic_probs = _divide(other_counts, self.total - self.cat_counts)
+        weighted = self.weighted_probs(rows, basic_probs, weight, ap)
+        doc_log_probs = numpy.log(weighted).sum(axis=0)
+        return self._as_dict(self.cat_log_probs() - doc_log_probs)
+
+    def fisher_probs(self, features, weight=1.0, ap=0.5):
+        """Fisher method scores of every category."""
+        rows = self.rows(features)
+        feature_probs = self.feature_probs(rows)
+        freq_sums = feature_probs.sum(axis=1)[:, numpy.newaxis]
+        basic_probs = _divide(feature_probs, freq_sums)
+        weighted = self.weighted_probs(rows, basic_probs, weight, ap)
+        fscores = -2 * numpy.log(weighted).sum(axis=0)
+        return self._as_dict(invchi2(fscores, len(rows) * 2))
+
+
+def invchi2(chi, dof):
+    """Vectorized inverse chi-square, summing the series in log space."""
+    m = numpy.asarray(chi, dtype=float)[..., numpy.newaxis] / 2.0
+    i = numpy.arange(max(dof // 2, 1))
+    log_factorials = _log_factorials(len(i))
+    log_m = numpy.log(numpy.maximum(m, numpy.finfo(float).tiny))
+    terms = numpy.exp(-m + i * log_m - log_factorials)
+    return numpy.minimum(terms.sum(axis=-1), 1.0)
+
+
+_log_factorial_table = None
+
+
+def _log_factorials(n):
+    """log(i!) for i < n, sliced from a table grown on demand."""
+    global _log_factorial_table
+    table = _log_factorial_table
+    if table is None or len(table) < n:
+        table = _log_factorial_table = numpy.array(
+            docclass.log_factorials(max(2 * n, 64)))
+    return table[:n]
+
+
+def _divide(a, b):
+    """a / b, with 0 wherever b is 0."""
+    a, b = numpy.broadcast_arrays(numpy.asarray(a, dtype=float),
+                                  numpy.asarray(b, dtype=float))
+    return numpy.divide(a, b, out=numpy.zeros(a.shape), where=(b != 0))
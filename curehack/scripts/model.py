@@ -0,0 +1,52 @@
+"""Export trained models to a model file, or import them from one.
+
+    curehack_model development.ini export models.cmdl
+    curehack_model development.ini import models.cmdl --user alice
+
+Exporting from one ``model_backend`` and importing with another migrates
+the models between backends. Importing replaces the users' models; it is
+not supported with ``model_backend = shared``, which ``curehack_retrain``
+rebuilds from the votes instead.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from curehack import modelfile
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config_uri')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='the model file')
+    parser.add_argument('--user', action='append', dest='users',
+                        help='only this user (repeatable)')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    options = parse_args(argv)
+    setup_logging(options.config_uri)
+    env = bootstrap(options.config_uri)
+    try:
+        if (options.command == 'import' and
+                env['registry'].settings.get('model_backend') == 'shared'):
+            print('model_backend = shared cannot import counts; rebuild the '
+                  'models with curehack_retrain', file=sys.stderr)
+            return 1
+        backend_factory = env['registry'].backend_factory
+        if options.command == 'export':
+            users = modelfile.export_models(backend_factory, options.path,
+                                            options.users)
+        else:
+            users = modelfile.import_models(backend_factory, options.path,
+                                            options.users)
+        print('%sed the models of %d users' % (options.command, len(users)))
+    finally:
+        env['closer']()
+    return 0
@@ -0,0 +1,50 @@
+"""Prune the trained models of every user (or of the given users).
+
+    curehack_prune development.ini --min-count 2 --max-features 5000
+
+Run it periodically, e.g. from cron, to keep models compact. Processes
+serving the app pick up the pruned models when the users train next.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from curehack import pruning
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config_uri')
+    parser.add_argument('--user', action='append', dest='users',
+                        help='prune only this user (repeatable)')
+    parser.add_argument('--min-count', type=float, default=2,
+                        help='prune features seen fewer times than this')
+    parser.add_argument('--max-features', type=int,
+                        help='keep at most this many features per user')
+    parser.add_argument('--score', choices=sorted(pruning.SCORES),
+                        default='frequency',
+                        help='how to choose the features to keep')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    options = parse_args(argv)
+    setup_logging(options.config_uri)
+    env = bootstrap(options.config_uri)
+    try:
+        if env['registry'].settings.get('model_backend') == 'shared':
+            print('model_backend = shared stores features per document and '
+                  'cannot be pruned per user', file=sys.stderr)
+            return 1
+        backend_factory = env['registry'].backend_factory
+        for user in options.users or backend_factory.users():
+            pruned = pruning.prune(backend_factory(user), options.min_count,
+                                   options.max_features, options.score)
+            print('%s: pruned %d features' % (user, len(pruned)))
+    finally:
+        env['closer']()
+    return 0
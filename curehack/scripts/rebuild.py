@@ -0,0 +1,60 @@
+"""Rebuild the aggregates of every user (or of the given users).
+
+    curehack_rebuild_aggregates development.ini
+
+Merges the duplicate rows of ``features`` and ``categories`` that racing
+trainings used to create, recomputes ``feature_totals``, ``totals`` and
+``likings`` from them, then builds the indexes (the unique ones refuse
+duplicates). Run it once to migrate models trained before those
+aggregates existed, or to repair them. Only ``model_backend = mongodb``
+keeps these aggregates.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from curehack import indexes
+from curehack.backends import MongoDBBackendFactory
+from curehack.choice import LikingChoice
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config_uri')
+    parser.add_argument('--user', action='append', dest='users',
+                        help='rebuild only this user (repeatable)')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    options = parse_args(argv)
+    setup_logging(options.config_uri)
+    env = bootstrap(options.config_uri)
+    try:
+        registry = env['registry']
+        backend = registry.settings.get('model_backend', 'mongodb')
+        if backend != 'mongodb':
+            print('model_backend = %s keeps no aggregates to rebuild'
+                  % backend, file=sys.stderr)
+            return 1
+        backend_factory = MongoDBBackendFactory(registry.mongo,
+                                                LikingChoice.int_mapping)
+        db = registry.mongo.database()
+        for collection, fields in indexes.COUNTED_COLLECTIONS:
+            merged = indexes.merge_duplicates(db, collection, fields)
+            if merged:
+                print('merged %d duplicates in %s' % (merged, collection))
+        users = options.users or backend_factory.users()
+        for user in users:
+            backend_factory(user).rebuild_aggregates()
+        print('rebuilt the aggregates of %d users' % len(users))
+        if indexes.ensure_indexes(
+                db, indexes.indexes_from_settings(registry.settings)):
+            return 1
+    finally:
+        env['closer']()
+    return 0
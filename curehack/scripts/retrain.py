@@ -0,0 +1,183 @@
+"""Rebuild trained models from the votes log and the precure catalog.
+
+    curehack_retrain development.ini --processes 4
+    curehack_retrain development.ini --checkpoint retrain.done --resume
+
+Users are sharded across a pool of processes. Each process counts a
+user's model in memory and replaces it with one bulk write per
+collection (``load_snapshot``). With ``model_backend = shared`` the
+description of every precure is re-tokenized first and the users' models
+are rebuilt from their documents (``load_documents``). Finished users are
+appended to the checkpoint file, so ``--resume`` continues an interrupted
+run. Run it after changing the tokenizer or fixing the counting, against
+the stores the app serves from (it cannot rebuild
+``model_backend = memory``).
+
+A model trained with more documents than its user's logged votes (trained
+before the votes log, or imported) would lose that training, so such
+users are skipped unless ``--include-unlogged`` is given.
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import logging
+import multiprocessing
+import sys
+import time
+
+from pyramid.paster import get_appsettings, setup_logging
+
+from curehack import votes
+from curehack.backends import backend_factory_from_settings
+from curehack.catalog import PrecureCatalog
+from curehack.choice import LikingChoice
+from curehack.connection import MongoConnector
+
+
+log = logging.getLogger(__name__)
+
+# Stores, per worker process
+_stores = None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config_uri')
+    parser.add_argument('--user', action='append', dest='users',
+                        help='only this user (repeatable)')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=100,
+                        help='users per task sent to a process')
+    parser.add_argument('--checkpoint',
+                        help='file listing the users already rebuilt')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the users in the checkpoint file')
+    parser.add_argument('--include-unlogged', action='store_true',
+                        help='also rebuild models trained with votes that '
+                        'are not in the votes log, losing that training')
+    return parser.parse_args(argv[1:])
+
+
+class Stores(object):
+    """The stores of the app configured in ``config_uri``
+
+    Built from the settings alone: the app itself is not started, so
+    workers build no indexes and explain no queries.
+    """
+
+    def __init__(self, config_uri):
+        settings = get_appsettings(config_uri)
+        self.connector = MongoConnector.from_settings(settings)
+        self.backend_factory = backend_factory_from_settings(
+            settings, self.connector, LikingChoice.int_mapping)
+        self.catalog = PrecureCatalog()
+
+
+def _init_worker(config_uri):
+    global _stores
+    _stores = Stores(config_uri)
+
+
+def trained_count(backend):
+    """Number of documents the model of ``backend`` was trained with
+
+    Summed over the category counts: ``total_count`` of MongoDB models
+    trained before ``totals`` existed misses their older training until
+    ``curehack_rebuild_aggregates`` has run.
+    """
+    return sum(backend.get_cat_count(cat) for cat in backend.categories())
+
+
+def retrain_shard(users, include_unlogged=False):
+    """Rebuild the models of ``users``; returns ``(done, failed, skipped)``
+
+    Users whose model holds training missing from the votes log are
+    skipped unless ``include_unlogged``.
+    """
+    db = _stores.connector.database()
+    precures = _stores.catalog.current(db)[1]
+    done, failed, skipped = [], [], []
+    for user in users:
+        try:
+            user_votes = votes.user_votes(db, user)
+            backend = _stores.backend_factory(user)
+            if (not include_unlogged and
+                    trained_count(backend) > votes.total_votes(user_votes)):
+                log.warning('%s has training missing from the votes log, '
+                            'skipped (see --include-unlogged)', user)
+                skipped.append(user)
+                continue
+            if getattr(backend, 'stores_documents', False):
+                backend.load_documents(
+                    votes.build_documents(user_votes, precures))
+            else:
+                backend.load_snapshot(
+                    votes.build_snapshot(user_votes, precures))
+        except Exception:
+            log.exception('Failed to rebuild the model of %s', user)
+            failed.append(user)
+        else:
+            done.append(user)
+    return done, failed, skipped
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return set(line.rstrip('\n') for line in f if line.strip())
+    except IOError:
+        return set()
+
+
+def main(argv=sys.argv):
+    options = parse_args(argv)
+    if options.resume and not options.checkpoint:
+        print('--resume needs --checkpoint', file=sys.stderr)
+        return 2
+    setup_logging(options.config_uri)
+    stores = Stores(options.config_uri)
+    db = stores.connector.database()
+    users = options.users or votes.users(db)
+    if hasattr(stores.backend_factory, 'store_documents'):
+        stores.backend_factory.store_documents(
+            (precure.description, precure.features)
+            for precure in stores.catalog.all(db))
+
+    if options.resume:
+        finished = read_checkpoint(options.checkpoint)
+        users = [user for user in users if user not in finished]
+    shards = [users[i:i + options.shard_size]
+              for i in range(0, len(users), options.shard_size)]
+
+    checkpoint = open(options.checkpoint, 'a') if options.checkpoint else None
+    pool = multiprocessing.Pool(options.processes, _init_worker,
+                                (options.config_uri,))
+    started = time.time()
+    rebuilt = failures = unlogged = 0
+    task = functools.partial(retrain_shard,
+                             include_unlogged=options.include_unlogged)
+    try:
+        for done, failed, skipped in pool.imap_unordered(task, shards):
+            if checkpoint is not None:
+                checkpoint.writelines(user + '\n' for user in done)
+                checkpoint.flush()
+            rebuilt += len(done)
+            failures += len(failed)
+            unlogged += len(skipped)
+            elapsed = time.time() - started
+            print('%d/%d users rebuilt, %d failed, %d skipped, '
+                  '%.1f users/s' % (rebuilt, len(users), failures, unlogged,
+                                    rebuilt / max(elapsed, 1e-9)),
+                  file=sys.stderr)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if checkpoint is not None:
+            checkpoint.close()
+    return 1 if failures else 0
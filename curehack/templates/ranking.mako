@@ -2,5 +2,8 @@
 
 ${form|n}
 
+% if updating:
+<p>Your votes are still being learned. Reload to see the latest ranking.</p>
+% endif
 
 ${ranking}
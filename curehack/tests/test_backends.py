@@ -0,0 +1,68 @@
+import unittest
+
+from curehack import backends
+from curehack import docclass
+
+
+class LoadSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        trained = backends.MemoryBackendFactory()('trained')
+        docclass.sample_train(docclass.NaiveBayesClassifier(
+            docclass.get_words, trained))
+        self.snapshot = trained.snapshot()
+
+        weights = dict((cat, 1) for cat in self.snapshot.cat_counts)
+        weights['bad'] = -1
+        self.factories = {
+            'memory': backends.MemoryBackendFactory(weights=weights),
+            'sqlite': backends.SQLiteBackendFactory(':memory:', weights),
+        }
+
+    def loaded(self, name):
+        backend = self.factories[name]('user')
+        # replaces what was trained before
+        backend.inc_counts({('stale', 'bad'): 3}, {'bad': 1})
+        backend.commit()
+        backend.load_snapshot(self.snapshot)
+        backend.commit()
+        return backend
+
+    def test_snapshot_round_trip(self):
+        for name in self.factories:
+            snapshot = self.loaded(name).snapshot()
+            self.assertEqual(snapshot.features, self.snapshot.features, name)
+            self.assertEqual(snapshot.cat_counts, self.snapshot.cat_counts,
+                             name)
+
+    def test_backends_agree(self):
+        memory, sqlite = self.loaded('memory'), self.loaded('sqlite')
+        self.assertEqual(sorted(memory.categories()),
+                         sorted(sqlite.categories()))
+        self.assertEqual(memory.total_count(), sqlite.total_count())
+        self.assertEqual(memory.total_count(), self.snapshot.total)
+        for feature in list(self.snapshot.features) + ['unseen']:
+            self.assertEqual(memory.get_feature_total(feature),
+                             sqlite.get_feature_total(feature))
+            for cat in self.snapshot.cat_counts:
+                self.assertEqual(memory.get_feature_count(feature, cat),
+                                 sqlite.get_feature_count(feature, cat))
+        self.assertEqual(dict(memory.ranking()), dict(sqlite.ranking()))
+        # ties may be cut at different features
+        self.assertEqual([score for _, score in memory.ranking(2, 2)],
+                         [score for _, score in sqlite.ranking(2, 2)])
+
+    def test_unbounded_ranking_end(self):
+        for name in self.factories:
+            backend = self.loaded(name)
+            everything = backend.ranking()
+            self.assertEqual(backend.ranking(2, None), everything, name)
+            self.assertEqual(backend.ranking(None, 2), everything, name)
+            self.assertEqual(backend.ranking(0, 0), [], name)
+
+    def test_version_moves(self):
+        for name in self.factories:
+            backend = self.factories[name]('user')
+            before = backend.model_version()[0]
+            backend.load_snapshot(self.snapshot)
+            backend.commit()
+            self.assertTrue(backend.model_version()[0] > before, name)
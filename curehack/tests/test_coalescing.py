@@ -0,0 +1,106 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from curehack import backends
+from curehack.coalescing import BufferedBackend, CounterBuffer
+
+
+class FlakyBackendFactory(backends.MemoryBackendFactory):
+    """Fails to write the counts of the users in ``failing``"""
+
+    def __init__(self):
+        super(FlakyBackendFactory, self).__init__()
+        self.failing = set()
+        self.writes = []
+
+    def __call__(self, user):
+        if user in self.failing:
+            raise IOError('%s is unavailable' % user)
+        self.writes.append(user)
+        return super(FlakyBackendFactory, self).__call__(user)
+
+
+class CounterBufferTests(unittest.TestCase):
+    def setUp(self):
+        self.factory = FlakyBackendFactory()
+        self.flushed = []
+        self.buffer = CounterBuffer(self.factory, max_keys=100,
+                                    max_staleness=60,
+                                    on_flush=self.flushed.append)
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.factory.failing.clear()
+        self.buffer.stop()
+
+    def test_merges_increments(self):
+        self.buffer.add('alice', {('smile', 'like'): 1}, {'like': 1})
+        self.buffer.add('alice', {('smile', 'like'): 2,
+                                  ('angry', 'unlike'): 1},
+                        {'like': 1, 'unlike': 1})
+        self.buffer.add('bob', {('smile', 'unlike'): 1}, {'unlike': 1})
+        self.assertEqual(self.buffer.size, 6)
+        self.assertEqual(self.factory.writes, [])
+
+        self.buffer.flush()
+        self.assertEqual(sorted(self.factory.writes), ['alice', 'bob'])
+        self.assertEqual(sorted(self.flushed), ['alice', 'bob'])
+        self.assertEqual(self.buffer.size, 0)
+
+        alice = self.factory('alice')
+        self.assertEqual(alice.get_feature_count('smile', 'like'), 3)
+        self.assertEqual(alice.get_feature_count('angry', 'unlike'), 1)
+        self.assertEqual(alice.get_cat_count('like'), 2)
+        self.assertEqual(self.factory('bob').total_count(), 1)
+
+    def test_due(self):
+        self.buffer.max_keys = 2
+        self.buffer.add('alice', {('smile', 'like'): 1}, {})
+        self.assertFalse(self.buffer.is_due())
+        self.buffer.add('alice', {('smile', 'like'): 1}, {'like': 1})
+        self.assertTrue(self.buffer.is_due())
+
+    def test_requeues_failed_flush(self):
+        self.factory.failing.add('alice')
+        self.buffer.add('alice', {('smile', 'like'): 1}, {'like': 1})
+        self.buffer.add('bob', {('smile', 'unlike'): 1}, {'unlike': 1})
+        self.buffer.flush()
+        self.assertEqual(self.flushed, ['bob'])
+        self.assertEqual(self.buffer.size, 2)
+        self.assertIsNotNone(self.buffer.oldest)
+
+        # increments made meanwhile are merged with the kept ones
+        self.buffer.add('alice', {('smile', 'like'): 2}, {'like': 1})
+        self.factory.failing.clear()
+        self.buffer.flush()
+        self.assertEqual(self.flushed, ['bob', 'alice'])
+        self.assertEqual(self.buffer.size, 0)
+        alice = self.factory('alice')
+        self.assertEqual(alice.get_feature_count('smile', 'like'), 3)
+        self.assertEqual(alice.get_cat_count('like'), 2)
+
+
+class BufferedBackendTests(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.factory = backends.SQLiteBackendFactory(
+            os.path.join(tmpdir, 'models.sqlite'))
+        self.buffer = CounterBuffer(self.factory, max_keys=100,
+                                    max_staleness=60)
+
+    def test_commit_commits_the_backend(self):
+        backend = BufferedBackend(self.buffer, self.factory('user'))
+        backend.inc_counts({('happy', 'like'): 1, ('sad', 'like'): 1},
+                           {'like': 1})
+        self.buffer.flush()
+        backend.delete_features(['sad'])
+        backend.commit()
+        self.assertEqual(
+            sorted(backends.SQLiteBackendFactory(
+                self.factory.path)('user').snapshot().features),
+            ['happy'])
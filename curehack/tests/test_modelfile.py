@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from curehack import backends
+from curehack import docclass
+from curehack import modelfile
+from curehack.cache import ModelCache
+
+
+class ModelFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'models.cmdl')
+        self.factory = backends.MemoryBackendFactory()
+        docclass.sample_train(docclass.NaiveBayesClassifier(
+            docclass.get_words, self.factory('alice')))
+        classifier = docclass.DefaultClassifier(self.factory(u'ボブ'))
+        classifier.train(u'笑顔がすてきなプリキュア', 'like')
+        classifier.train(u'怒りっぽい', 'unlike')
+        self.factory('empty')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dump_load(self):
+        snapshot = self.factory('alice').snapshot()
+        snapshot.version = 3
+        buf = io.BytesIO()
+        modelfile.dump([('alice', snapshot),
+                        ('empty', docclass.ModelSnapshot({}, {}))], buf)
+
+        model_file = modelfile.ModelFile(buf.getvalue())
+        self.assertEqual(sorted(model_file.users()), ['alice', 'empty'])
+        loaded = model_file.snapshot('alice')
+        self.assertEqual(loaded.features, snapshot.features)
+        self.assertEqual(loaded.cat_counts, snapshot.cat_counts)
+        self.assertEqual(loaded.version, 3)
+        empty = model_file.snapshot('empty')
+        self.assertEqual((empty.features, empty.cat_counts), ({}, {}))
+
+    def test_not_a_model_file(self):
+        self.assertRaises(ValueError, modelfile.ModelFile,
+                          b'NOTMODEL' + b'\0' * 8)
+
+    def test_export_import(self):
+        users = modelfile.export_models(self.factory, self.path)
+        self.assertEqual(sorted(users), sorted(self.factory.users()))
+
+        other = backends.MemoryBackendFactory()
+        modelfile.import_models(other, self.path)
+        for user in users:
+            expected = self.factory(user).snapshot()
+            snapshot = other(user).snapshot()
+            self.assertEqual(snapshot.features, expected.features)
+            self.assertEqual(snapshot.cat_counts, expected.cat_counts)
+
+        mapped = modelfile.open_mapped(self.path)
+        self.assertEqual(mapped.snapshot(u'ボブ').features,
+                         self.factory(u'ボブ').snapshot().features)
+
+    def test_warm_skips_models_trained_since(self):
+        modelfile.export_models(self.factory, self.path)
+        docclass.DefaultClassifier(self.factory('alice')).train(
+            'trained after the export', 'good')
+
+        cache = ModelCache(10 ** 7)
+        warmed = modelfile.warm(self.path, cache, self.factory)
+        self.assertEqual(sorted(warmed), [u'ボブ'])
+        self.assertIsNone(cache.get('alice'))
+        self.assertEqual(cache.get(u'ボブ').version,
+                         self.factory(u'ボブ').model_version()[0])
+
+    def test_warm_loads(self):
+        modelfile.export_models(self.factory, self.path)
+        other = backends.MemoryBackendFactory()
+        cache = ModelCache(10 ** 7)
+        warmed = modelfile.warm(self.path, cache, other, load=True)
+        self.assertEqual(sorted(warmed), sorted(self.factory.users()))
+        self.assertEqual(cache.get('alice').version,
+                         other('alice').model_version()[0])
+        self.assertEqual(other('alice').snapshot().features,
+                         self.factory('alice').snapshot().features)
@@ -0,0 +1,110 @@
+import math
+import unittest
+
+from curehack import backends
+from curehack import docclass
+from curehack import scoring
+
+
+def old_invchi2(chi, dof):
+    """The series summed term by term, as before log space scoring"""
+    m = chi / 2.0
+    sum = term = math.exp(-m)
+    for i in range(1, dof // 2):
+        term *= m / i
+        sum += term
+    return min(sum, 1.0)
+
+
+ITEMS = [
+    'the quick rabbit',
+    'quick money in the casino',
+    'nobody owns the quick brown fox',
+    'unseen words only',
+]
+
+
+class InvChi2Tests(unittest.TestCase):
+    def test_matches_old_series(self):
+        for dof in (2, 4, 10, 40, 200):
+            for chi in (0.01, 0.5, 1.0, 3.0, 10.0, 50.0, 300.0):
+                self.assertAlmostEqual(docclass.invchi2(chi, dof),
+                                       old_invchi2(chi, dof), places=12)
+
+    def test_zero(self):
+        self.assertEqual(docclass.invchi2(0.0, 10), 1.0)
+
+    def test_large_dof_does_not_overflow(self):
+        self.assertAlmostEqual(docclass.invchi2(4000.0, 4000), 0.5, places=1)
+
+    @unittest.skipIf(scoring.numpy is None, 'numpy is not installed')
+    def test_vectorized(self):
+        chis = [0.5, 3.0, 50.0]
+        for dof in (2, 10, 200):
+            result = scoring.invchi2(chis, dof)
+            for chi, value in zip(chis, result):
+                self.assertAlmostEqual(value, old_invchi2(chi, dof),
+                                       places=12)
+
+
+@unittest.skipIf(scoring.numpy is None, 'numpy is not installed')
+class EngineTests(unittest.TestCase):
+    def setUp(self):
+        backend = backends.MemoryBackendFactory()('user')
+        docclass.sample_train(docclass.NaiveBayesClassifier(
+            docclass.get_words, backend))
+        self.snapshot = backend.snapshot()
+
+    def assertSameScores(self, cls):
+        backend = docclass.SnapshotBackend(self.snapshot)
+        pure = cls(docclass.get_words, backend)
+        vector = cls(docclass.get_words, backend,
+                     engine=scoring.engine_for(self.snapshot))
+        for item in ITEMS:
+            expected = pure.scores(item)
+            scores = vector.scores(item)
+            self.assertEqual(sorted(scores), sorted(expected))
+            for cat in expected:
+                self.assertAlmostEqual(scores[cat], expected[cat], places=9)
+            self.assertEqual(vector.classify(item), pure.classify(item))
+
+    def test_naive_bayes(self):
+        self.assertSameScores(docclass.NaiveBayesClassifier)
+
+    def test_complement_naive_bayes(self):
+        self.assertSameScores(docclass.ComplementNaiveBayesClassifier)
+
+    def test_fisher(self):
+        self.assertSameScores(docclass.FisherClassifier)
+
+
+class LogSpaceTests(unittest.TestCase):
+    """Scores without the engine, for items long enough to underflow"""
+
+    def setUp(self):
+        self.backend = backends.MemoryBackendFactory()('user')
+        docclass.sample_train(docclass.NaiveBayesClassifier(
+            docclass.get_words, self.backend))
+        self.item = ' '.join('word%d quick' % i for i in range(1500))
+
+    def test_naive_bayes(self):
+        classifier = docclass.NaiveBayesClassifier(docclass.get_words,
+                                                   self.backend)
+        scores = classifier.scores(self.item)
+        self.assertFalse(any(math.isinf(s) for s in scores.values()))
+        self.assertEqual(classifier.classify(self.item), 'good')
+
+    def test_complement_naive_bayes(self):
+        classifier = docclass.ComplementNaiveBayesClassifier(
+            docclass.get_words, self.backend)
+        scores = classifier.scores(self.item)
+        self.assertFalse(any(math.isinf(s) for s in scores.values()))
+        self.assertEqual(classifier.classify(self.item), 'good')
+
+    def test_matches_products_for_short_items(self):
+        classifier = docclass.NaiveBayesClassifier(docclass.get_words,
+                                                   self.backend)
+        for item in ITEMS:
+            for cat, score in classifier.scores(item).items():
+                self.assertAlmostEqual(
+                    score, math.log(classifier.prob(item, cat)), places=9)
@@ -0,0 +1,29 @@
+import unittest
+
+from curehack import backends
+from curehack import training
+
+
+class TrainingQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.queue = training.TrainingQueue(
+            backends.MemoryBackendFactory(), workers=1)
+        self.addCleanup(self.queue.stop)
+
+    def test_waits_for_its_own_tokens(self):
+        token = self.queue.put('user', [('happy', ['happy'], 'like')])
+        version = self.queue.version_of(token)
+        self.assertEqual(version, 1)
+        self.assertTrue(self.queue.wait('user', version, 5))
+        self.assertFalse(self.queue.is_pending('user'))
+
+    def test_ignores_tokens_of_other_processes(self):
+        other = training.TrainingQueue(backends.MemoryBackendFactory(),
+                                       workers=1)
+        self.addCleanup(other.stop)
+        token = other.put('user', [('happy', ['happy'], 'like')])
+        self.assertIsNone(self.queue.version_of(token))
+        self.queue.start()
+        self.assertIsNone(self.queue.version_of(token))
+        self.assertIsNone(self.queue.version_of('1'))
+        self.assertIsNone(self.queue.version_of(''))
@@ -0,0 +1,181 @@
+"""Background training of classifiers.
+
+``views.train`` puts ``(user, [(description, features, category), ...])``
+jobs on a :class:`TrainingQueue` and redirects at once. Worker threads
+drain the queue in batches, merge the jobs of each user and train them
+with one ``Classifier.train_documents`` call, i.e. one bulk write per user
+and batch. The votes of the jobs are then recorded in the ``vote_log``,
+one bulk write per user and batch too.
+The jobs of a user always go to the same worker, so they are trained in
+order.
+
+Each job gets a per-user version token; the result page can wait for it
+(:meth:`TrainingQueue.wait`) or show that the model is still updating.
+Tokens carry the epoch of the process that queued the job, so a token
+from another pre-fork worker or from before a restart is not waited for
+(:meth:`TrainingQueue.version_of`).
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from pyramid.settings import asbool
+
+from curehack import docclass
+
+
+log = logging.getLogger(__name__)
+
+
+class TrainingQueue(object):
+    def __init__(self, backend_factory, model_cache=None, workers=2,
+                 batch_size=100, classifier_factory=None, vote_log=None):
+        self.backend_factory = backend_factory
+        self.model_cache = model_cache
+        self.vote_log = vote_log
+        self.workers = workers
+        self.batch_size = batch_size
+        self.classifier_factory = (classifier_factory or
+                                   docclass.DefaultClassifier)
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.submitted = {}
+        self.applied = {}
+        self.condition = threading.Condition()
+        self.threads = []
+        self.epoch = None
+        self._pid = None
+
+    def start(self):
+        """Start the workers of the current process
+
+        Called on the first job, so pre-fork servers start them in every
+        worker process rather than in the parent.
+        """
+        with self.condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.epoch = uuid.uuid4().hex[:12]
+            self.threads = [threading.Thread(target=self._run, args=(jobs,),
+                                             name='curehack-training-%d' % i)
+                            for i, jobs in enumerate(self.queues)]
+            for thread in self.threads:
+                thread.daemon = True
+                thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Train the queued jobs and stop the workers"""
+        if self._pid != os.getpid():
+            return
+        for jobs in self.queues:
+            jobs.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def put(self, user, documents, votes=()):
+        """Queue training ``documents`` for ``user``, returning a version
+        token
+
+        ``votes`` are the ``(vote, precure name)`` pairs to record once
+        the documents are trained.
+        """
+        self.start()
+        with self.condition:
+            version = self.submitted[user] = self.submitted.get(user, 0) + 1
+        self.queues[hash(user) % self.workers].put(
+            (user, version, list(documents), list(votes)))
+        return '%s-%d' % (self.epoch, version)
+
+    def version_of(self, token):
+        """The version a :meth:`put` token stands for in this process
+
+        None if the token was made by another process, or by this one
+        before it restarted, whose jobs this queue does not know.
+        """
+        epoch, _, version = token.rpartition('-')
+        if epoch and epoch == self.epoch and version.isdigit():
+            return int(version)
+        return None
+
+    def is_pending(self, user):
+        with self.condition:
+            return self.applied.get(user, 0) < self.submitted.get(user, 0)
+
+    def wait(self, user, version, timeout=None):
+        """Wait until the job ``version`` of ``user`` is trained
+
+        Returns whether it was trained within ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.applied.get(user, 0) < version:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self.condition.wait(remaining)
+            return True
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            batch = [job]
+            while job is not None and len(batch) < self.batch_size:
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(job)
+
+            self.apply([job for job in batch if job is not None])
+            if None in batch:
+                return
+
+    def apply(self, jobs):
+        """Train ``jobs`` with one ``train_documents`` call per user"""
+        merged = {}
+        for user, version, documents, votes in jobs:
+            user_documents, user_votes, latest = merged.get(user,
+                                                            ([], [], 0))
+            merged[user] = (user_documents + documents, user_votes + votes,
+                            max(latest, version))
+
+        for user, (documents, votes, version) in merged.items():
+            try:
+                classifier = self.classifier_factory(
+                    self.backend_factory(user))
+                classifier.train_documents(documents)
+                if self.vote_log is not None:
+                    self.vote_log.record(user, votes)
+            except Exception:
+                log.exception('Failed to train %d items of %s',
+                              len(documents), user)
+            if self.model_cache is not None:
+                self.model_cache.invalidate(user)
+            with self.condition:
+                self.applied[user] = max(self.applied.get(user, 0), version)
+                self.condition.notify_all()
+
+
+def training_queue_from_settings(settings, backend_factory, model_cache,
+                                 vote_log=None):
+    """:class:`TrainingQueue` if ``training_async`` is on, else None"""
+    if not asbool(settings.get('training_async', False)):
+        return None
+    return TrainingQueue(backend_factory, model_cache,
+                         workers=int(settings.get('training_workers', 2)),
+                         batch_size=int(settings.get('training_batch_size',
+                                                     100)),
+                         vote_log=vote_log)
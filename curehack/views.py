@@ -1,32 +1,71 @@
 from pyramid.view import view_config
 from pyramid import httpexceptions as httpexc
 
+import colander
 import deform
 
+from curehack import httpcache
 from curehack import schemas
 
 
+class PrefersPredicate(object):
+    """ View predicate matching when the client prefers the first media
+    type of ``val`` to the rest. The rest win ties unless the first type
+    is named in the Accept header, so ``*/*`` or no Accept does not match.
+    """
+
+    def __init__(self, val, config):
+        self.val = tuple(val)
+
+    def text(self):
+        return 'prefers = %s' % (self.val,)
+
+    phash = text
+
+    def __call__(self, context, request):
+        wanted = self.val[0]
+        offers = request.accept.acceptable_offers(self.val[1:] + (wanted,))
+        if not offers or offers[0][0] == wanted:
+            return bool(offers)
+        parsed = getattr(request.accept, 'parsed', None) or ()
+        named = any(media_range.lower() == wanted
+                    for media_range, _, _, _ in parsed)
+        return named and dict(offers).get(wanted) == offers[0][1]
+
+
 @view_config(route_name='home',
              request_method='GET',
              renderer='curehack:templates/home.mako')
 def home(request):
-    precure_names = request.context.precure_names
-    schema = schemas.PrecureTrainSchemaNode(precure_names)
-    form = deform.Form(schema, buttons=('submit',),
-                       action=request.route_url('train'))
-    return dict(form=form.render(),
+    version, schema = request.context.train_schema
+    action = request.route_url('train')
+    form = request.registry.forms.render(
+        ('train', version, action),
+        lambda: deform.Form(schema, buttons=('submit',), action=action))
+    return dict(form=form,
                 desc_link=request.route_url('precures'))
 
 
 @view_config(route_name='train',
              request_method='POST')
 def train(request):
-    classifier = request.context.classifier
-    for cat, desc in request.context.category_descriptions:
-        classifier.train(desc, cat)
+    user = request.context.user
+    documents = request.context.documents
+    category_names = request.context.category_names
+
+    training_queue = request.registry.training_queue
+    if training_queue is None:
+        request.context.classifier.train_documents(documents)
+        request.registry.model_cache.invalidate(user)
+        if request.registry.vote_log is not None:
+            request.registry.vote_log.record(user, category_names)
+        query = {}
+    else:
+        query = {'version': training_queue.put(user, documents,
+                                               category_names)}
 
     return httpexc.HTTPFound(
-        location=request.route_url('result', user=request.context.user)
+        location=request.route_url('result', user=user, _query=query)
     )
 
 
@@ -34,14 +73,32 @@ def train(request):
              request_method='GET',
              renderer='curehack:templates/ranking.mako')
 def result(request):
-    schema = schemas.PrecureClassifySchema()
-    form = deform.Form(schema,
-                       buttons=('submit',),
-                       method='GET',
-                       action=request.route_url('classify',
-                                                user=request.context.user))
-    return dict(ranking=request.context.ranking,
-                form=form.render())
+    action = request.route_url('classify', user=request.context.user)
+    form = request.registry.forms.render(
+        ('classify', action),
+        lambda: deform.Form(schemas.PrecureClassifySchema(),
+                            buttons=('submit',),
+                            method='GET',
+                            action=action))
+    context = request.context
+    try:
+        ranking_range = context.ranking_range
+    except colander.Invalid as e:
+        raise httpexc.HTTPBadRequest(e.asdict())
+
+    updating = context.updating
+    if updating:
+        ranking = context.ranking
+    else:
+        httpcache.check_model_version(request, context.model_version, 'html')
+        ranking = httpcache.cached(
+            request,
+            ('ranking', context.user, context.model_version[0],
+             ranking_range['top'], ranking_range['bottom']),
+            lambda: context.ranking)
+    return dict(ranking=ranking,
+                updating=updating,
+                form=form)
 
 
 @view_config(route_name='precures',
@@ -49,19 +106,22 @@ def result(request):
              renderer='curehack:templates/precures.mako')
 def precures(request):
     precures = request.context.precures
-    schema = schemas.PrecureRegisterSchema()
-    form = deform.Form(schema, buttons=('submit',),
-                       action=request.route_url('register'))
+    action = request.route_url('register')
+    form = request.registry.forms.render(
+        ('register', action),
+        lambda: deform.Form(schemas.PrecureRegisterSchema(),
+                            buttons=('submit',),
+                            action=action))
     return dict(precures=precures,
-                form=form.render())
+                form=form)
 
 
 @view_config(route_name='register',
              request_method='POST')
 def register_precure(request):
-    # TODO: Move this logic to specified module.
-    request.db.precures.insert({'name': request.context.name,
-                                'description': request.context.description})
+    request.registry.catalog.register(request.db,
+                                      request.context.name,
+                                      request.context.description)
     return httpexc.HTTPFound(request.route_url('precures'))
 
 
@@ -69,6 +129,71 @@ def register_precure(request):
              request_method='GET',
              renderer='curehack:templates/classify.mako')
 def classify(request):
-    classifier = request.context.classifier
-    category = classifier.classify(request.context.item)
+    context = request.context
+    version = context.scored_version
+    httpcache.check_model_version(request, version, 'html')
+    item = context.item
+    category = httpcache.cached(
+        request, ('classify', context.user, version[0], item),
+        lambda: context.classifier.classify(item))
     return dict(category=category)
+
+
+@view_config(route_name='classify',
+             request_method='GET',
+             accept='application/json',
+             prefers=('application/json', 'text/html'),
+             renderer='json')
+def classify_json(request):
+    context = request.context
+    try:
+        params = context.explain_params
+    except colander.Invalid as e:
+        request.response.status_int = 400
+        return dict(errors=e.asdict())
+
+    version = context.scored_version
+    httpcache.check_model_version(request, version, 'json')
+    explanations = httpcache.cached(
+        request,
+        ('explain', context.user, version[0], params['item'],
+         params['k'], params['features']),
+        lambda: context.classifier.explain(params['item'], params['k'],
+                                           params['features']))
+    return dict(user=context.user,
+                item=params['item'],
+                ranking=[dict(category=e['category'],
+                              score=e['score'],
+                              features=[dict(feature=f, contribution=c)
+                                        for f, c in e['features']])
+                         for e in explanations])
+
+
+@view_config(route_name='classify_batch',
+             request_method='POST',
+             renderer='json')
+def classify_batch(request):
+    try:
+        user_items = request.context.user_items
+    except ValueError:
+        request.response.status_int = 400
+        return dict(errors={'': 'Invalid JSON body'})
+    except colander.Invalid as e:
+        request.response.status_int = 400
+        return dict(errors=e.asdict())
+
+    indexes = {}
+    for i, (user, item) in enumerate(user_items):
+        indexes.setdefault(user, []).append(i)
+
+    categories = [None] * len(user_items)
+    for user, user_indexes in indexes.items():
+        classifier = request.context.classifier_for(user)
+        results = classifier.classify_many(user_items[i][1]
+                                           for i in user_indexes)
+        for i, category in zip(user_indexes, results):
+            categories[i] = category
+
+    return dict(results=[dict(user=user, item=item, category=category)
+                         for (user, item), category
+                         in zip(user_items, categories)])
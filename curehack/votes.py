@@ -0,0 +1,99 @@
+"""Log of the votes users trained their models with.
+
+With ``votes_log`` on (the default unless ``model_backend = memory``),
+every training adds its votes to ``votes``, one document per (user,
+precure, vote) counting how many times it was cast, so models can be
+rebuilt from the votes and the precure catalog (``curehack_retrain``)
+after the tokenizer or the counting changes. Votes are recorded where the
+training runs: in the ``/train/`` request, or batched per user by the
+``TrainingQueue`` workers with ``training_async``.
+"""
+
+from pymongo import UpdateOne
+from pyramid.settings import asbool
+
+from curehack import docclass
+
+
+def record(db, user, votes):
+    """Count the ``(vote, precure name)`` pairs ``user`` trained with"""
+    if not votes:
+        return
+    counts = {}
+    for vote, name in votes:
+        counts[(name, vote)] = counts.get((name, vote), 0) + 1
+    db.votes.bulk_write([
+        UpdateOne({'user': user, 'precure': name, 'vote': vote},
+                  {'$inc': {'count': count}}, upsert=True)
+        for (name, vote), count in counts.items()
+    ], ordered=False)
+
+
+class VoteLog(object):
+    """Records votes in the ``votes`` collection of ``connector``"""
+
+    def __init__(self, connector):
+        self.connector = connector
+
+    def record(self, user, votes):
+        record(self.connector.database(), user, votes)
+
+
+def vote_log_from_settings(settings, connector):
+    """:class:`VoteLog` if ``votes_log`` is on, else None"""
+    default = settings.get('model_backend', 'mongodb') != 'memory'
+    if not asbool(settings.get('votes_log', default)):
+        return None
+    return VoteLog(connector)
+
+
+def total_votes(votes):
+    """Number of documents trained with ``user_votes``"""
+    return sum(count for name, vote, count in votes)
+
+
+def users(db):
+    return db.votes.distinct('user')
+
+
+def user_votes(db, user):
+    """``(precure name, vote, count)`` of every vote of ``user``"""
+    return [(d['precure'], d['vote'], d['count'])
+            for d in db.votes.find({'user': user},
+                                   {'_id': 0, 'precure': 1, 'vote': 1,
+                                    'count': 1})]
+
+
+def build_snapshot(votes, precures):
+    """The model trained with ``votes``, counted in memory
+
+    ``precures`` maps names to catalog ``Precure``s; votes for precures
+    no longer in the catalog are skipped. The counts equal those of
+    training every vote through ``Classifier.train_many``.
+    """
+    features = {}
+    cat_counts = {}
+    for name, vote, count in votes:
+        precure = precures.get(name)
+        if precure is None:
+            continue
+        cat_counts[vote] = cat_counts.get(vote, 0) + count
+        for feature in precure.features:
+            counts = features.setdefault(feature, {})
+            counts[vote] = counts.get(vote, 0.0) + count
+    return docclass.ModelSnapshot(features, cat_counts)
+
+
+def build_documents(votes, precures):
+    """``(description, features, vote, count)`` of every vote
+
+    The documents :meth:`SharedDocumentBackend.load_documents` rebuilds a
+    model from; votes for precures no longer in the catalog are skipped.
+    """
+    documents = []
+    for name, vote, count in votes:
+        precure = precures.get(name)
+        if precure is not None:
+            documents.append((precure.description, precure.features, vote,
+                              count))
+    return documents
@@ -10,7 +10,7 @@ requires = [
     'deform',
     'pyramid',
     'pyramid_debugtoolbar',
-    'pymongo',
+    'pymongo>=3.6',
     'waitress',
     ]
 
@@ -28,14 +28,24 @@ setup(name='curehack',
       author_email='',
       url='',
       keywords='web pyramid pylons',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
+      extras_require={
+          'numpy': ['numpy'],
+          'benchmark': ['mongomock', 'webtest'],
+          'asgi': ['motor'],
+          },
       tests_require=requires,
       test_suite="curehack",
       entry_points="""\
       [paste.app_factory]
       main = curehack:main
+      [console_scripts]
+      curehack_prune = curehack.scripts.prune:main
+      curehack_model = curehack.scripts.model:main
+      curehack_retrain = curehack.scripts.retrain:main
+      curehack_rebuild_aggregates = curehack.scripts.rebuild:main
       """,
       )